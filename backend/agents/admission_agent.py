@@ -2,41 +2,99 @@
 Admission Decision Agent
 Makes admission decisions based on extracted data and handbook rules
 """
+import asyncio
+import dataclasses
+import functools
 import logging
-import os
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
 import anthropic
-from .state import ApplicationState, AdmissionDecision, ExtractedData
+from pydantic import ValidationError
+from .state import ApplicationState, AdmissionDecision, ClassifiedDocument, ExtractedData
+from .decision_cache import DecisionCache, get_decision_cache
+from clients import get_async_client, get_request_semaphore
 from rag.retriever import AdmissionRulesRetriever
 import json
 
 logger = logging.getLogger(__name__)
 
+# Retrieval results kept for repeated query sets (same program and qualification mix)
+RULES_CACHE_SIZE = 1024
+
+# Fixed decision instructions and rubric, sent first. Too short for prompt
+# caching (below the minimum cacheable prefix), so no cache_control is set.
+DECISION_INSTRUCTIONS = """
+    You are an expert admission officer for IU University making an admission decision.
+    
+    You will be given the APPLICANT PROFILE, the RELEVANT HANDBOOK RULES,
+    the TARGET PROGRAM and the ENTITY. Based on the handbook rules and
+    applicant qualifications, make an admission decision.
+    
+    Consider:
+    1. Does the applicant meet minimum qualification requirements?
+    2. Are grades/scores sufficient for the program?
+    3. Are there any regulatory compliance issues?
+    4. Is there sufficient evidence to make a confident decision?
+    
+    Submit your decision with the submit_decision tool:
+    - status: APPROVED, REJECTED or REVIEW_REQUIRED
+    - confidence: 0.0 to 1.0
+    - reasoning: detailed explanation with specific rule references
+    - applied_rules: [{"rule_id": "R1", "outcome": "satisfied|not_satisfied"}], where rule_id
+      is the rule_id of the handbook source the rule comes from
+    - handbook_citations: e.g. ["page 42", "section 3.2"]
+    - missing_documents: []
+    
+    If confidence is below 0.8, use REVIEW_REQUIRED status.
+    """
+
+# Forcing this tool makes Claude return schema-conformant decision JSON
+DECISION_TOOL = {
+    "name": "submit_decision",
+    "description": "Submit the admission decision for this applicant",
+    "input_schema": AdmissionDecision.model_json_schema()
+}
+
 class AdmissionDecisionAgent:
     """
     Agent that makes admission decisions using RAG + business rules
     """
     
     def __init__(self):
-        # Get API key from environment
-        anthropic_key = os.getenv("ANTHROPIC_API_KEY")
-        if not anthropic_key:
-            raise ValueError("ANTHROPIC_API_KEY not found in environment")
-            
-        self.client = anthropic.Anthropic(api_key=anthropic_key)
         self.model = "claude-3-5-sonnet-20241022"
         
         # Initialize RAG system for handbook queries
         self.rag_retriever = AdmissionRulesRetriever()
         
+        # Applicants with the same program and qualification mix share one retrieval
+        # (the batch path runs in a worker thread, so access is serialized with a lock)
+        self._rules_cache: "OrderedDict[Tuple[str, ...], Dict[str, Any]]" = OrderedDict()
+        self._rules_lock = threading.Lock()
+        
         # Required documents by entity
         self.required_docs = {
-            "DE": ["transcript", "abitur"],  # German entity
-            "UK": ["transcript", "a_levels"],  # UK entity  
-            "CA": ["transcript"]  # Canadian entity
+            "DE": frozenset({"transcript", "abitur"}),  # German entity
+            "UK": frozenset({"transcript", "a_levels"}),  # UK entity  
+            "CA": frozenset({"transcript"})  # Canadian entity
         }
     
-    def process(self, state: ApplicationState) -> ApplicationState:
+    @functools.cached_property
+    def decision_cache(self) -> DecisionCache:
+        """
+        Decisions for equivalent applicant profiles are reused across applications
+        """
+        return get_decision_cache()
+    
+    @property
+    def client(self) -> anthropic.AsyncAnthropic:
+        """
+        Shared async client for the running event loop
+        """
+        return get_async_client()
+    
+    async def aprocess(self, state: ApplicationState) -> ApplicationState:
         """
         Make admission decision based on extracted data
         """
@@ -45,20 +103,16 @@ class AdmissionDecisionAgent:
         state.current_stage = "making_decision"
         
         try:
-            # Check document completeness first
-            missing_docs = self._check_document_completeness(state)
+            decision, cached = await self.decide(
+                state.target_program, state.entity, state.classified_documents, state.extracted_data
+            )
             
-            if missing_docs:
-                decision = AdmissionDecision(
-                    status="MISSING_DOCS",
-                    confidence=1.0,
-                    reasoning=f"Missing required documents: {', '.join(missing_docs)}",
-                    applied_rules=[],
-                    missing_documents=missing_docs
+            if cached:
+                state.add_log(
+                    agent="AdmissionDecision",
+                    action="decision_cache_hit",
+                    details={"status": decision.status}
                 )
-            else:
-                # Make admission decision using RAG + rules
-                decision = self._evaluate_admission(state)
             
             state.admission_decision = decision
             state.current_stage = "decision_made"
@@ -88,48 +142,110 @@ class AdmissionDecisionAgent:
         
         return state
     
-    def _check_document_completeness(self, state: ApplicationState) -> List[str]:
+    def check_completeness(self, state: ApplicationState) -> ApplicationState:
         """
-        Check if all required documents are present and classified
+        Decide MISSING_DOCS right after classification, before any extraction is paid for
+        """
+        decision = self.completeness_decision(state.entity, state.classified_documents)
+        
+        if decision:
+            state.admission_decision = decision
+            state.current_stage = "decision_made"
+            
+            state.add_log(
+                agent="AdmissionDecision",
+                action="make_decision",
+                details={
+                    "status": decision.status,
+                    "confidence": decision.confidence,
+                    "rules_applied": 0
+                }
+            )
+            
+            logger.info(f"Application {state.application_id} is missing documents: {', '.join(decision.missing_documents)}")
+        
+        return state
+    
+    def completeness_decision(self, entity: str, classified_documents: List[ClassifiedDocument]) -> Optional[AdmissionDecision]:
         """
-        required = self.required_docs.get(state.entity, [])
-        provided_types = [doc.document_type for doc in state.classified_documents]
+        Return a MISSING_DOCS decision if required documents are missing, otherwise None
+        """
+        missing_docs = self._check_document_completeness(entity, classified_documents)
+        
+        if not missing_docs:
+            return None
         
-        missing = []
-        for doc_type in required:
-            if doc_type not in provided_types:
-                missing.append(doc_type)
+        return AdmissionDecision(
+            status="MISSING_DOCS",
+            confidence=1.0,
+            reasoning=f"Missing required documents: {', '.join(missing_docs)}",
+            applied_rules=[],
+            missing_documents=missing_docs
+        )
+    
+    async def decide(
+        self,
+        target_program: str,
+        entity: str,
+        classified_documents: List[ClassifiedDocument],
+        extracted_data: List[ExtractedData]
+    ) -> Tuple[AdmissionDecision, bool]:
+        """
+        Make the admission decision - returns the decision and whether it came from the decision cache
+        """
+        # Check document completeness first
+        decision = self.completeness_decision(entity, classified_documents)
+        if decision:
+            return decision, False
+        
+        # Make admission decision using RAG + rules
+        return await self._evaluate_admission(target_program, entity, extracted_data)
+    
+    def _check_document_completeness(self, entity: str, classified_documents: List[ClassifiedDocument]) -> List[str]:
+        """
+        Check if all required documents are present and classified
+        """
+        required = self.required_docs.get(entity, frozenset())
+        provided_types = {doc.document_type for doc in classified_documents}
         
-        return missing
+        # Sorted so the MISSING_DOCS reasoning is stable across runs
+        return sorted(required - provided_types)
     
-    def _evaluate_admission(self, state: ApplicationState) -> AdmissionDecision:
+    async def _evaluate_admission(self, target_program: str, entity: str, extracted_data: List[ExtractedData]) -> Tuple[AdmissionDecision, bool]:
         """
         Evaluate admission using RAG system and business rules
         """
         # Build applicant profile from extracted data
-        applicant_profile = self._build_applicant_profile(state)
+        applicant_profile = self._build_applicant_profile(target_program, entity, extracted_data)
+        
+        # Reuse the decision of an equivalent prior applicant, skipping RAG and Claude
+        cached_decision = self.decision_cache.get(applicant_profile, target_program, entity)
+        if cached_decision:
+            return cached_decision, True
         
         # Query handbook for relevant admission rules
-        handbook_rules = self._query_admission_rules(state.target_program, applicant_profile)
+        handbook_rules = await self._query_admission_rules(target_program, applicant_profile)
         
         # Apply decision logic
-        decision = self._apply_decision_logic(applicant_profile, handbook_rules, state)
+        decision = await self._apply_decision_logic(applicant_profile, handbook_rules, target_program, entity)
         
-        return decision
+        self.decision_cache.put(applicant_profile, target_program, entity, decision)
+        
+        return decision, False
     
-    def _build_applicant_profile(self, state: ApplicationState) -> Dict[str, Any]:
+    def _build_applicant_profile(self, target_program: str, entity: str, extracted_data: List[ExtractedData]) -> Dict[str, Any]:
         """
         Build comprehensive applicant profile from extracted data
         """
         profile = {
-            "target_program": state.target_program,
-            "entity": state.entity,
+            "target_program": target_program,
+            "entity": entity,
             "qualifications": [],
             "work_experience": [],
             "personal_info": {}
         }
         
-        for extraction in state.extracted_data:
+        for extraction in extracted_data:
             if extraction.document_type == "transcript":
                 profile["qualifications"].append({
                     "type": "university_degree",
@@ -153,7 +269,7 @@ class AdmissionDecisionAgent:
         
         return profile
     
-    def _query_admission_rules(self, target_program: str, profile: Dict[str, Any]) -> Dict[str, Any]:
+    async def _query_admission_rules(self, target_program: str, profile: Dict[str, Any]) -> Dict[str, Any]:
         """
         Query the handbook for relevant admission rules
         """
@@ -178,93 +294,113 @@ class AdmissionDecisionAgent:
         if profile.get("work_experience"):
             queries.append(f"Can work experience substitute for academic qualifications in {target_program}?")
         
-        # Execute queries and aggregate results
-        all_rules = []
-        for query in queries:
-            try:
-                result = self.rag_retriever.query_admission_rules(query)
-                all_rules.append(result)
-            except Exception as e:
-                logger.warning(f"RAG query failed: {query} - {e}")
+        # Drop repeated queries (e.g. two qualifications of the same subtype), keeping order
+        queries = list(dict.fromkeys(queries))
         
-        return {"queries": queries, "results": all_rules}
+        # Execute all queries as one batched retrieval
+        try:
+            result = await self._retrieve_rules(tuple(queries))
+        except Exception as e:
+            logger.warning(f"RAG batch query failed: {queries} - {e}")
+            return {"queries": queries, "answer": None, "sources": []}
+        
+        # Number the sources so the decision can reference rules by id only
+        sources = [
+            {"rule_id": f"R{i}", **dataclasses.asdict(source)}
+            for i, source in enumerate(result["sources"], start=1)
+        ]
+        
+        return {"queries": queries, "answer": result["answer"], "sources": sources}
     
-    def _apply_decision_logic(self, profile: Dict[str, Any], handbook_rules: Dict[str, Any], state: ApplicationState) -> AdmissionDecision:
+    async def _retrieve_rules(self, queries: Tuple[str, ...]) -> Dict[str, Any]:
         """
-        Apply comprehensive decision logic combining RAG results with business rules
+        Run the batched handbook retrieval, reusing the result for repeated query sets
         """
-        # Prepare decision context
-        decision_context = {
-            "applicant_profile": profile,
-            "handbook_rules": handbook_rules,
-            "target_program": state.target_program,
-            "entity": state.entity
-        }
+        with self._rules_lock:
+            result = self._rules_cache.get(queries)
+            if result is not None:
+                self._rules_cache.move_to_end(queries)
+                return result
         
-        prompt = f"""
-        You are an expert admission officer for IU University making an admission decision.
+        result = await self.rag_retriever.aquery_admission_rules_batch(list(queries))
         
+        with self._rules_lock:
+            self._rules_cache[queries] = result
+            if len(self._rules_cache) > RULES_CACHE_SIZE:
+                self._rules_cache.popitem(last=False)
+        return result
+    
+    async def _apply_decision_logic(self, profile: Dict[str, Any], handbook_rules: Dict[str, Any], target_program: str, entity: str) -> AdmissionDecision:
+        """
+        Apply comprehensive decision logic combining RAG results with business rules
+        """
+        # Compact JSON - indentation only adds input tokens
+        content = [
+            {
+                "type": "text",
+                "text": DECISION_INSTRUCTIONS
+            },
+            {
+                "type": "text",
+                "text": f"""
         APPLICANT PROFILE:
-        {json.dumps(profile, indent=2)}
+        {json.dumps(profile, separators=(",", ":"), ensure_ascii=False)}
         
         RELEVANT HANDBOOK RULES:
-        {json.dumps(handbook_rules, indent=2)}
-        
-        TARGET PROGRAM: {state.target_program}
-        ENTITY: {state.entity}
-        
-        Based on the handbook rules and applicant qualifications, make an admission decision.
-        
-        Consider:
-        1. Does the applicant meet minimum qualification requirements?
-        2. Are grades/scores sufficient for the program?
-        3. Are there any regulatory compliance issues?
-        4. Is there sufficient evidence to make a confident decision?
-        
-        Respond with JSON format:
-        {{
-            "status": "APPROVED|REJECTED|REVIEW_REQUIRED",
-            "confidence": 0.95,
-            "reasoning": "detailed explanation with specific rule references",
-            "applied_rules": [
-                {{"rule_id": "R1", "rule_text": "...", "outcome": "satisfied|not_satisfied"}},
-                {{"rule_id": "R2", "rule_text": "...", "outcome": "satisfied|not_satisfied"}}
-            ],
-            "handbook_citations": ["page 42", "section 3.2"],
-            "missing_documents": [],
-            "concerns": ["any concerns or risk factors"]
-        }}
-        
-        If confidence is below 0.8, use REVIEW_REQUIRED status.
+        {json.dumps(handbook_rules, separators=(",", ":"), ensure_ascii=False)}
+        
+        TARGET PROGRAM: {target_program}
+        ENTITY: {entity}
         """
+            }
+        ]
         
-        response = self.client.messages.create(
-            model=self.model,
-            max_tokens=2000,
-            temperature=0.1,
-            messages=[{"role": "user", "content": prompt}]
-        )
+        # Stream the tool input so generation progress is visible as it arrives
+        json_parts = []
+        async with get_request_semaphore():
+            started = time.perf_counter()
+            async with self.client.messages.stream(
+                model=self.model,
+                max_tokens=800,
+                temperature=0.1,
+                tools=[DECISION_TOOL],
+                tool_choice={"type": "tool", "name": DECISION_TOOL["name"]},
+                messages=[{"role": "user", "content": content}]
+            ) as stream:
+                async for event in stream:
+                    if event.type == "content_block_delta" and event.delta.type == "input_json_delta":
+                        if not json_parts:
+                            logger.info(f"Decision stream started after {time.perf_counter() - started:.2f}s")
+                        json_parts.append(event.delta.partial_json)
+        
+        logger.info(f"Decision stream completed after {time.perf_counter() - started:.2f}s")
         
         try:
-            decision_data = json.loads(response.content[0].text)
+            decision = AdmissionDecision.model_validate_json("".join(json_parts))
+            return self._attach_rule_text(decision, handbook_rules)
             
-            return AdmissionDecision(
-                status=decision_data["status"],
-                confidence=decision_data["confidence"],
-                reasoning=decision_data["reasoning"],
-                applied_rules=decision_data.get("applied_rules", []),
-                missing_documents=decision_data.get("missing_documents", []),
-                handbook_citations=decision_data.get("handbook_citations", [])
-            )
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse decision JSON: {e}")
+        except ValidationError as e:
+            logger.error(f"Decision tool input failed validation: {e}")
             
             # Fallback decision
             return AdmissionDecision(
                 status="REVIEW_REQUIRED",
                 confidence=0.0,
-                reasoning="Decision parsing failed - requires manual review",
+                reasoning="Decision validation failed - requires manual review",
                 applied_rules=[],
                 handbook_citations=[]
-            )
\ No newline at end of file
+            )
+    
+    def _attach_rule_text(self, decision: AdmissionDecision, handbook_rules: Dict[str, Any]) -> AdmissionDecision:
+        """
+        Fill in rule text and page for applied rules from the retrieved handbook sources
+        """
+        sources = {source["rule_id"]: source for source in handbook_rules.get("sources", [])}
+        
+        for rule in decision.applied_rules:
+            source = sources.get(rule.get("rule_id"))
+            if source:
+                rule["rule_text"] = source["excerpt"]
+                rule["page"] = source["page"]
+        
+        return decision
\ No newline at end of file
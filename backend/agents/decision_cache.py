@@ -0,0 +1,99 @@
+"""
+Decision Cache
+Reuses admission decisions for applicants with equivalent profiles
+"""
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from .state import AdmissionDecision
+
+logger = logging.getLogger(__name__)
+
+# Longer strings are treated as free text and left out of the cache key
+MAX_KEY_STRING_LENGTH = 64
+
+class DecisionCache:
+    """
+    Cache of admission decisions keyed by the canonical profile hash. Only exact
+    matches are reused - profiles differing in a single grade embed almost
+    identically, so similar applicants are always decided on their own.
+    """
+    
+    def __init__(self, max_entries: int = 5000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, AdmissionDecision]" = OrderedDict()
+    
+    def get(self, profile: Dict[str, Any], target_program: str, entity: str) -> Optional[AdmissionDecision]:
+        """
+        Return the cached decision for an equivalent profile, if any
+        """
+        key = self._make_key(self._canonical_json(profile), target_program, entity)
+        
+        with self._lock:
+            decision = self._entries.get(key)
+            if decision is None:
+                return None
+            self._entries.move_to_end(key)
+        
+        logger.info(f"Decision cache hit: {key}")
+        return decision.model_copy(deep=True)
+    
+    def put(self, profile: Dict[str, Any], target_program: str, entity: str, decision: AdmissionDecision):
+        """
+        Store a decision. REVIEW_REQUIRED decisions are never cached.
+        """
+        if decision.status == "REVIEW_REQUIRED":
+            return
+        
+        key = self._make_key(self._canonical_json(profile), target_program, entity)
+        
+        with self._lock:
+            self._entries[key] = decision.model_copy(deep=True)
+            self._entries.move_to_end(key)
+            
+            # Evict least recently used entries
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def _canonical_json(self, profile: Dict[str, Any]) -> str:
+        """
+        Canonical profile: grades rounded, free text and personal info dropped, lists sorted
+        """
+        relevant = {k: v for k, v in profile.items() if k != "personal_info"}
+        return json.dumps(self._canonicalize(relevant), sort_keys=True, separators=(",", ":"))
+    
+    def _canonicalize(self, value: Any) -> Any:
+        if isinstance(value, dict):
+            return {
+                k: self._canonicalize(v)
+                for k, v in sorted(value.items())
+                if not self._is_free_text(v)
+            }
+        if isinstance(value, list):
+            items = [self._canonicalize(v) for v in value if not self._is_free_text(v)]
+            return sorted(items, key=lambda item: json.dumps(item, sort_keys=True))
+        if isinstance(value, float):
+            return round(value, 1)
+        return value
+    
+    def _is_free_text(self, value: Any) -> bool:
+        return isinstance(value, str) and len(value) > MAX_KEY_STRING_LENGTH
+    
+    def _make_key(self, canonical: str, target_program: str, entity: str) -> str:
+        digest = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+        return f"admission:{entity}:{target_program}:{digest}"
+
+_shared_cache: Optional[DecisionCache] = None
+
+def get_decision_cache() -> DecisionCache:
+    """
+    Process-wide decision cache, shared by all decision agents
+    """
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = DecisionCache()
+    return _shared_cache
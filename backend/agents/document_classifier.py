@@ -2,13 +2,16 @@
 Document Classification Agent
 Classifies uploaded documents into categories
 """
+import asyncio
 import logging
 import os
-from typing import List, Dict, Any
+import re
+from typing import List, Dict, Any, Optional
 import anthropic
 from .state import ApplicationState, ClassifiedDocument, DocumentFile
+from clients import get_async_client, get_request_semaphore
+from .document_text import extract_pdf_text, MAX_TEXT_PAGES
 from config.settings import settings
-import pypdf
 import base64
 import json
 
@@ -20,13 +23,8 @@ class DocumentClassifierAgent:
     """
     
     def __init__(self):
-        # Get API key from environment
-        anthropic_key = os.getenv("ANTHROPIC_API_KEY")
-        if not anthropic_key:
-            raise ValueError("ANTHROPIC_API_KEY not found in environment")
-            
-        self.client = anthropic.Anthropic(api_key=anthropic_key)
-        self.model = "claude-3-5-sonnet-20241022"
+        # Classification is a short, high-volume task - Haiku is fast and cheap enough
+        self.model = os.getenv("CLAUDE_CLASSIFIER_MODEL", "claude-3-5-haiku-20241022")
         
         self.document_types = [
             "transcript",      # University/school transcripts
@@ -39,38 +37,65 @@ class DocumentClassifierAgent:
             "apprenticeship", # Apprenticeship certificates
             "other"           # Unclassified documents
         ]
+        
+        # Unambiguous filename patterns, matched against the normalized filename stem.
+        # Checked in order; only whole words that cannot name another document type count,
+        # so "bachelor_thesis.pdf" or "master_cv.pdf" are never taken for transcripts.
+        self._filename_patterns = [
+            (re.compile(r"\babitur\b", re.IGNORECASE), "abitur"),
+            (re.compile(r"\ba ?levels?\b", re.IGNORECASE), "a_levels"),
+            (re.compile(r"\bib\b|\binternational ?bacc", re.IGNORECASE), "ib"),
+            (re.compile(r"\b(?:cv|resume)\b", re.IGNORECASE), "cv"),
+            (re.compile(r"\bpassport\b", re.IGNORECASE), "passport"),
+            (re.compile(r"\b(?:transcripts?|transcript ?of ?records|notenspiegel)\b", re.IGNORECASE), "transcript"),
+            (re.compile(r"\b(?:work\b|employment|arbeits)", re.IGNORECASE), "work_certificate")
+        ]
+    
+    @property
+    def client(self) -> anthropic.AsyncAnthropic:
+        """
+        Shared async client for the running event loop
+        """
+        return get_async_client()
     
     def process(self, state: ApplicationState) -> ApplicationState:
         """
-        Main processing function - classifies all uploaded documents
+        Synchronous entry point for the LangGraph pipeline
+        """
+        return asyncio.run(self.aprocess(state))
+    
+    async def aprocess(self, state: ApplicationState) -> ApplicationState:
+        """
+        Main processing function - classifies all uploaded documents concurrently
         """
         logger.info(f"Classifying {len(state.uploaded_files)} documents for application {state.application_id}")
         
         state.current_stage = "classifying_documents"
         classified_docs = []
         
-        for file in state.uploaded_files:
-            try:
-                classification = self._classify_single_document(file)
-                classified_docs.append(classification)
-                
-                state.add_log(
-                    agent="DocumentClassifier",
-                    action="classify_document", 
-                    details={
-                        "file": file.filename,
-                        "classified_as": classification.document_type,
-                        "confidence": classification.confidence
-                    }
-                )
-                
-            except Exception as e:
-                logger.error(f"Failed to classify {file.filename}: {str(e)}")
+        tasks = [self.classify_document(file) for file in state.uploaded_files]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        
+        for file, result in zip(state.uploaded_files, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to classify {file.filename}: {str(result)}")
                 state.add_log(
                     agent="DocumentClassifier",
                     action="classification_error",
-                    details={"file": file.filename, "error": str(e)}
+                    details={"file": file.filename, "error": str(result)}
                 )
+                continue
+            
+            classified_docs.append(result)
+            state.add_log(
+                agent="DocumentClassifier",
+                action="classify_document", 
+                details={
+                    "file": file.filename,
+                    "classified_as": result.document_type,
+                    "confidence": result.confidence
+                }
+            )
         
         state.classified_documents = classified_docs
         state.current_stage = "documents_classified"
@@ -78,9 +103,43 @@ class DocumentClassifierAgent:
         logger.info(f"Classified {len(classified_docs)} documents")
         return state
     
-    def _classify_single_document(self, file: DocumentFile) -> ClassifiedDocument:
+    async def classify_document(self, file: DocumentFile) -> ClassifiedDocument:
+        """
+        Classify a single document, using Claude only when the filename is ambiguous
+        """
+        classification = self.classify_by_filename(file)
+        if classification:
+            return classification
+        
+        # PDF parsing runs in a worker thread so it overlaps with in-flight requests
+        request = await asyncio.to_thread(self.build_request, file)
+        
+        async with get_request_semaphore():
+            response = await self.client.messages.create(**request)
+        
+        return self.parse_response(file, response)
+    
+    def classify_by_filename(self, file: DocumentFile) -> Optional[ClassifiedDocument]:
+        """
+        Classify a document from its filename alone, or return None if it is ambiguous
+        """
+        # Underscores and punctuation become spaces so \b matches in "abitur_2023"
+        stem = os.path.splitext(file.filename)[0]
+        normalized = re.sub(r"[_\W]+", " ", stem)
+        
+        for pattern, document_type in self._filename_patterns:
+            if pattern.search(normalized):
+                return ClassifiedDocument(
+                    file=file,
+                    document_type=document_type,
+                    confidence=0.9
+                )
+        
+        return None
+    
+    def build_request(self, file: DocumentFile) -> Dict[str, Any]:
         """
-        Classify a single document using Claude
+        Build the Messages API parameters for classifying one document
         """
         # Extract text from document
         text_content = self._extract_text(file)
@@ -103,19 +162,21 @@ class DocumentClassifierAgent:
         Respond with JSON format:
         {{
             "document_type": "category",
-            "confidence": 0.95,
-            "reasoning": "brief explanation"
+            "confidence": 0.95
         }}
         """
         
-        response = self.client.messages.create(
-            model=self.model,
-            max_tokens=500,
-            temperature=0.1,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        
-        # Parse response
+        return {
+            "model": self.model,
+            "max_tokens": 120,
+            "temperature": 0,
+            "messages": [{"role": "user", "content": prompt}]
+        }
+    
+    def parse_response(self, file: DocumentFile, response) -> ClassifiedDocument:
+        """
+        Turn a Claude classification response into a ClassifiedDocument
+        """
         try:
             result = json.loads(response.content[0].text)
             
@@ -138,8 +199,12 @@ class DocumentClassifierAgent:
         """
         Extract text from PDF or image files
         """
+        # Text extracted once at upload time is shared with the data extractor
+        if file.text_content is not None:
+            return file.text_content
+        
         try:
-            if file.file_type.lower() == "pdf":
+            if file.file_path.lower().endswith('.pdf'):
                 return self._extract_pdf_text(file.file_path)
             else:
                 # For images, we'd use OCR here
@@ -154,16 +219,8 @@ class DocumentClassifierAgent:
         Extract text from PDF file
         """
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = pypdf.PdfReader(file)
-                text = ""
-                
-                # Extract text from first few pages
-                for page_num in range(min(3, len(pdf_reader.pages))):
-                    page = pdf_reader.pages[page_num]
-                    text += page.extract_text() + "\n"
-                
-                return text
+            # Same page limit as the extractor so both share one cached parse
+            return extract_pdf_text(file_path, max_pages=MAX_TEXT_PAGES)
                 
         except Exception as e:
             logger.error(f"PDF text extraction failed: {e}")
@@ -0,0 +1,34 @@
+"""
+Shared document text extraction
+Parses each PDF once and serves repeat reads from an in-process cache
+"""
+import functools
+import logging
+import os
+from typing import Optional
+import pypdf
+
+logger = logging.getLogger(__name__)
+
+# Admission-relevant fields (grades, names, dates) are on the first pages
+MAX_TEXT_PAGES = 5
+
+@functools.lru_cache(maxsize=512)
+def _extract_pdf_text_cached(path: str, mtime: float, max_pages: Optional[int]) -> str:
+    """
+    Parse the PDF - keyed by modification time so edited files are re-read
+    """
+    with open(path, 'rb') as file:
+        pdf_reader = pypdf.PdfReader(file)
+        num_pages = len(pdf_reader.pages)
+        if max_pages is not None:
+            num_pages = min(max_pages, num_pages)
+        
+        pages = [pdf_reader.pages[page_num].extract_text() for page_num in range(num_pages)]
+        return "\n".join(pages)
+
+def extract_pdf_text(file_path: str, max_pages: Optional[int] = None) -> str:
+    """
+    Extract text from a PDF file, optionally limited to the first max_pages pages
+    """
+    return _extract_pdf_text_cached(file_path, os.path.getmtime(file_path), max_pages)
@@ -1,9 +1,114 @@
 """
 State management for the admissions agent workflow
 """
-from typing import List, Dict, Any, Optional, Literal
-from pydantic import BaseModel
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Literal, Deque, Tuple
+from pydantic import BaseModel, Field, PrivateAttr, computed_field
 from datetime import datetime
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Log entries kept in memory per application - the full history is in the JSONL file
+MAX_LOG_ENTRIES = 256
+
+@dataclass(slots=True)
+class AgentLog:
+    """Agent log entry - a compact record, converted to a dict only for API responses"""
+    timestamp: float  # seconds since the epoch
+    agent: str
+    action: str
+    details: Dict[str, Any]
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "timestamp": datetime.fromtimestamp(self.timestamp),
+            "agent": self.agent,
+            "action": self.action,
+            "details": self.details
+        }
+
+def make_log_entry(agent: str, action: str, details: Dict[str, Any]) -> AgentLog:
+    """Build an agent log entry"""
+    return AgentLog(timestamp=time.time(), agent=agent, action=action, details=details)
+
+def record_log(application_id: str, agent: str, action: str, details: Dict[str, Any]) -> AgentLog:
+    """Build an agent log entry and queue it for the application's JSONL log file"""
+    entry = make_log_entry(agent, action, details)
+    # Graph nodes run on the event loop, so file writes happen in a background thread
+    _ensure_log_writer()
+    _log_queue.put((application_id, entry))
+    return entry
+
+# (application_id, entry) pairs waiting to be written; None stops the writer
+_log_queue: "queue.SimpleQueue[Optional[Tuple[str, AgentLog]]]" = queue.SimpleQueue()
+_log_writer: Optional[threading.Thread] = None
+_log_writer_lock = threading.Lock()
+
+def _write_logs():
+    """Append queued log entries to their JSONL files until stopped"""
+    try:
+        os.makedirs(settings.AGENT_LOG_DIR, exist_ok=True)
+    except OSError as e:
+        logger.warning(f"Failed to create agent log directory: {e}")
+    
+    stopped = False
+    while not stopped:
+        # Wait for an entry, then drain everything queued behind it
+        items = [_log_queue.get()]
+        while True:
+            try:
+                items.append(_log_queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        # Each application's file is opened once per drained batch and closed when it is written
+        log_files = {}
+        for item in items:
+            if item is None:
+                stopped = True
+                continue
+            application_id, entry = item
+            try:
+                log_file = log_files.get(application_id)
+                if log_file is None:
+                    log_path = os.path.join(settings.AGENT_LOG_DIR, f"{application_id}.jsonl")
+                    log_file = log_files[application_id] = open(log_path, "a", buffering=8192)
+                log_file.write(json.dumps(entry.to_dict(), default=str, ensure_ascii=False) + "\n")
+            except OSError as e:
+                logger.warning(f"Failed to persist agent log for {application_id}: {e}")
+        
+        for application_id, log_file in log_files.items():
+            try:
+                log_file.close()
+            except OSError as e:
+                logger.warning(f"Failed to persist agent log for {application_id}: {e}")
+
+def _ensure_log_writer():
+    """Start the writer thread - again after a fork, since threads do not survive it"""
+    global _log_writer
+    with _log_writer_lock:
+        if _log_writer is None or not _log_writer.is_alive():
+            _log_writer = threading.Thread(target=_write_logs, name="agent-log-writer", daemon=True)
+            _log_writer.start()
+
+@atexit.register
+def close_agent_log():
+    """Write out all queued log entries and stop the writer thread"""
+    global _log_writer
+    with _log_writer_lock:
+        writer, _log_writer = _log_writer, None
+    if writer is not None and writer.is_alive():
+        _log_queue.put(None)
+        writer.join()
 
 class DocumentFile(BaseModel):
     file_id: str
@@ -11,6 +116,7 @@ class DocumentFile(BaseModel):
     file_type: str  # pdf, jpg, png
     file_path: str
     size_bytes: int
+    text_content: Optional[str] = None  # extracted once at upload, shared by agents
 
 class ClassifiedDocument(BaseModel):
     file: DocumentFile
@@ -28,8 +134,8 @@ class AdmissionDecision(BaseModel):
     confidence: float
     reasoning: str
     applied_rules: List[Dict[str, Any]]
-    missing_documents: List[str] = []
-    handbook_citations: List[str] = []
+    missing_documents: List[str] = Field(default_factory=list)
+    handbook_citations: List[str] = Field(default_factory=list)
     
 class ApplicationState(BaseModel):
     """
@@ -40,26 +146,39 @@ class ApplicationState(BaseModel):
     applicant_id: str
     target_program: str
     entity: str = "DE"
-    uploaded_files: List[DocumentFile] = []
+    uploaded_files: List[DocumentFile] = Field(default_factory=list)
+    sla: Literal["interactive", "batch"] = "interactive"  # batch runs through the Message Batches API
     
     # Processing stages
-    classified_documents: List[ClassifiedDocument] = []
-    extracted_data: List[ExtractedData] = []
+    classified_documents: List[ClassifiedDocument] = Field(default_factory=list)
+    extracted_data: List[ExtractedData] = Field(default_factory=list)
     admission_decision: Optional[AdmissionDecision] = None
     
     # Metadata
-    created_at: datetime = datetime.now()
+    created_at: datetime = Field(default_factory=datetime.now)
     current_stage: str = "created"
     error_message: Optional[str] = None
     
-    # Agent outputs
-    agent_logs: List[Dict[str, Any]] = []
+    # Agent outputs - bounded in memory, not a field, so state updates never revalidate it
+    _logs: Deque[AgentLog] = PrivateAttr(default_factory=lambda: deque(maxlen=MAX_LOG_ENTRIES))
+    
+    def __init__(self, agent_logs: Optional[List[AgentLog]] = None, **data):
+        super().__init__(**data)
+        # Entries carried over from an earlier state are already on disk
+        if agent_logs:
+            self._logs.extend(agent_logs)
+    
+    @property
+    def agent_logs(self) -> List[AgentLog]:
+        """Most recent agent log entries"""
+        return list(self._logs)
+    
+    @computed_field
+    @property
+    def recent_logs(self) -> List[Dict[str, Any]]:
+        """Most recent agent log entries, included when the state is serialized"""
+        return [log.to_dict() for log in self._logs]
     
     def add_log(self, agent: str, action: str, details: Dict[str, Any]):
         """Add log entry for agent action"""
-        self.agent_logs.append({
-            "timestamp": datetime.now(),
-            "agent": agent,
-            "action": action,
-            "details": details
-        })
\ No newline at end of file
+        self._logs.append(record_log(self.application_id, agent, action, details))
\ No newline at end of file
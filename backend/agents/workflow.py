@@ -1,17 +1,48 @@
 """
 LangGraph workflow orchestrating the admission agents
 """
+import asyncio
+import functools
 import logging
-from typing import Dict, Any, TypedDict, List, Optional
-from langgraph.graph import StateGraph, END
-from .state import ApplicationState, DocumentFile, ClassifiedDocument, ExtractedData, AdmissionDecision
+import operator
+from typing import Dict, Any, TypedDict, List, Optional, Annotated, Union
+from langgraph.checkpoint.aiosqlite import AsyncSqliteSaver
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.constants import Send
+from langgraph.graph import StateGraph, END, START
+from .state import ApplicationState, DocumentFile, ClassifiedDocument, ExtractedData, AdmissionDecision, AgentLog, record_log
 from .document_classifier import DocumentClassifierAgent
 from .data_extractor import DataExtractionAgent
 from .admission_agent import AdmissionDecisionAgent
+from clients import get_async_client
+from config.settings import settings
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# One checkpoint store shared by every workflow instance
+_checkpointer = None
+
+def get_checkpointer() -> AsyncSqliteSaver:
+    """
+    SQLite checkpointer persisting the workflow state of every application
+    """
+    global _checkpointer
+    if _checkpointer is None:
+        _checkpointer = AsyncSqliteSaver.from_conn_string(settings.CHECKPOINT_DB_PATH)
+    return _checkpointer
+
+async def close_checkpointer():
+    """
+    Close the checkpoint database - its connection thread otherwise keeps the process alive
+    """
+    global _checkpointer
+    if _checkpointer is not None:
+        await _checkpointer.conn.close()
+        _checkpointer = None
+        # The cached workflow was compiled against the closed checkpointer
+        get_workflow.cache_clear()
+
 # TypedDict for LangGraph state
 class WorkflowState(TypedDict):
     """State that flows through LangGraph"""
@@ -20,12 +51,13 @@ class WorkflowState(TypedDict):
     target_program: str
     entity: str
     uploaded_files: List[DocumentFile]
-    classified_documents: List[ClassifiedDocument]
-    extracted_data: List[ExtractedData]
+    # Per-document branches run in parallel and append their results
+    classified_documents: Annotated[List[ClassifiedDocument], operator.add]
+    extracted_data: Annotated[List[ExtractedData], operator.add]
     admission_decision: Optional[AdmissionDecision]
     current_stage: str
     error_message: Optional[str]
-    agent_logs: List[Dict[str, Any]]
+    agent_logs: Annotated[List[AgentLog], operator.add]
     created_at: datetime
 
 class AdmissionWorkflow:
@@ -47,31 +79,24 @@ class AdmissionWorkflow:
         """
         workflow = StateGraph(WorkflowState)
         
-        # Add nodes (agents)
-        workflow.add_node("classify_documents", self._classify_documents_node)
-        workflow.add_node("extract_data", self._extract_data_node)
+        # Add nodes (agents). process_document runs once per document in parallel and
+        # pipelines classification into extraction; check_documents waits for all branches.
+        workflow.add_node("process_document", self._process_document_node)
+        workflow.add_node("check_documents", self._check_documents_node)
         workflow.add_node("make_decision", self._make_decision_node)
         workflow.add_node("handle_error", self._handle_error_node)
         
-        # Define the flow
-        workflow.set_entry_point("classify_documents")
+        # Fan out over the uploaded files
+        workflow.add_conditional_edges(START, self._route_uploaded_files)
+        workflow.add_edge("process_document", "check_documents")
         
-        # From classify_documents
+        # From check_documents - incomplete applications end with a MISSING_DOCS decision
         workflow.add_conditional_edges(
-            "classify_documents",
-            self._should_continue_after_classification,
-            {
-                "continue": "extract_data",
-                "error": "handle_error"
-            }
-        )
-        
-        # From extract_data
-        workflow.add_conditional_edges(
-            "extract_data", 
-            self._should_continue_after_extraction,
+            "check_documents",
+            self._should_continue_after_documents,
             {
                 "continue": "make_decision",
+                "incomplete": END,
                 "error": "handle_error"
             }
         )
@@ -80,49 +105,26 @@ class AdmissionWorkflow:
         workflow.add_edge("make_decision", END)
         workflow.add_edge("handle_error", END)
         
-        return workflow.compile()
+        # Checkpointed per application (thread_id), so state survives restarts
+        return workflow.compile(checkpointer=get_checkpointer())
     
-    def process_application(self, state: ApplicationState) -> ApplicationState:
+    async def process_application(self, state: ApplicationState) -> ApplicationState:
         """
         Main entry point - process an application through the workflow
         """
         logger.info(f"Starting workflow for application {state.application_id}")
         
         try:
-            # Convert ApplicationState to dict for LangGraph
-            state_dict = {
-                "application_id": state.application_id,
-                "applicant_id": state.applicant_id,
-                "target_program": state.target_program,
-                "entity": state.entity,
-                "uploaded_files": state.uploaded_files,
-                "classified_documents": state.classified_documents,
-                "extracted_data": state.extracted_data,
-                "admission_decision": state.admission_decision,
-                "current_stage": state.current_stage,
-                "error_message": state.error_message,
-                "agent_logs": state.agent_logs,
-                "created_at": state.created_at
-            }
+            # Convert ApplicationState to dict for LangGraph once - nodes work on the dict
+            # and the ApplicationState is rebuilt once from the final result
+            state_dict = _application_state_values(state)
             
-            # Run the workflow
-            result = self.workflow.invoke(state_dict)
+            # Run the workflow - async nodes fan out per document
+            config = {"configurable": {"thread_id": state.application_id}}
+            result = await self.workflow.ainvoke(state_dict, config)
             
             # Convert back to ApplicationState
-            result_state = ApplicationState(
-                application_id=result["application_id"],
-                applicant_id=result["applicant_id"],
-                target_program=result["target_program"],
-                entity=result["entity"],
-                uploaded_files=result["uploaded_files"],
-                classified_documents=result.get("classified_documents", []),
-                extracted_data=result.get("extracted_data", []),
-                admission_decision=result.get("admission_decision"),
-                current_stage=result.get("current_stage", "completed"),
-                error_message=result.get("error_message"),
-                agent_logs=result.get("agent_logs", []),
-                created_at=result["created_at"]
-            )
+            result_state = _application_state_from_values(result)
             
             logger.info(f"Workflow completed for application {state.application_id}")
             return result_state
@@ -133,154 +135,392 @@ class AdmissionWorkflow:
             state.current_stage = "workflow_error"
             return state
     
-    # Node implementations - now work with dicts
-    def _classify_documents_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
-        """Node for document classification"""
-        # Convert dict to ApplicationState
-        app_state = ApplicationState(
-            application_id=state["application_id"],
-            applicant_id=state["applicant_id"],
-            target_program=state["target_program"],
-            entity=state["entity"],
-            uploaded_files=state["uploaded_files"],
-            classified_documents=state.get("classified_documents", []),
-            extracted_data=state.get("extracted_data", []),
-            admission_decision=state.get("admission_decision"),
-            current_stage=state.get("current_stage", "classifying"),
-            error_message=state.get("error_message"),
-            agent_logs=state.get("agent_logs", []),
-            created_at=state["created_at"]
-        )
+    @property
+    def batch_client(self):
+        """
+        Shared async client for the Message Batches API (non-interactive applications)
+        """
+        return get_async_client()
+    
+    async def process_batch(self, states: List[ApplicationState], poll_interval: float = 60.0) -> List[ApplicationState]:
+        """
+        Process non-interactive applications through the Message Batches API.
+        Classification and extraction calls for all applications are submitted
+        as one batch per stage (half the price of online calls); decisions run online.
+        """
+        logger.info(f"Starting batch workflow for {len(states)} applications")
+        
+        # Stage 1: classify every uploaded file of every application
+        requests = []
+        targets = {}
+        for state in states:
+            state.current_stage = "classifying_documents"
+            for file in state.uploaded_files:
+                # Files with an unambiguous filename never reach the batch
+                classification = self.document_classifier.classify_by_filename(file)
+                if classification:
+                    state.classified_documents.append(classification)
+                    state.add_log(
+                        agent="DocumentClassifier",
+                        action="classify_document",
+                        details={
+                            "file": file.filename,
+                            "classified_as": classification.document_type,
+                            "confidence": classification.confidence
+                        }
+                    )
+                    continue
+                
+                custom_id = f"cls_{state.application_id}_{file.file_id}"
+                requests.append({"custom_id": custom_id, "params": self.document_classifier.build_request(file)})
+                targets[custom_id] = (state, file)
+        
+        responses = await self._run_message_batch(requests, poll_interval)
+        for custom_id, (state, file) in targets.items():
+            if custom_id not in responses:
+                state.add_log(
+                    agent="DocumentClassifier",
+                    action="classification_error",
+                    details={"file": file.filename, "error": "Batch request did not succeed"}
+                )
+                continue
+            
+            classification = self.document_classifier.parse_response(file, responses[custom_id])
+            state.classified_documents.append(classification)
+            state.add_log(
+                agent="DocumentClassifier",
+                action="classify_document",
+                details={
+                    "file": file.filename,
+                    "classified_as": classification.document_type,
+                    "confidence": classification.confidence
+                }
+            )
+        
+        active = []
+        for state in states:
+            state.current_stage = "documents_classified"
+            if not any(doc.confidence > 0.5 for doc in state.classified_documents):
+                self._fail_batch_application(state, "No documents classified with sufficient confidence")
+                continue
+            
+            # Incomplete applications get their MISSING_DOCS decision without extraction
+            self.admission_agent.check_completeness(state)
+            if not state.admission_decision:
+                active.append(state)
+        
+        # Stage 2: extract data from every classified document
+        requests = []
+        targets = {}
+        for state in active:
+            state.current_stage = "extracting_data"
+            for doc in state.classified_documents:
+                custom_id = f"ext_{state.application_id}_{doc.file.file_id}"
+                requests.append({"custom_id": custom_id, "params": self.data_extractor.build_request(doc)})
+                targets[custom_id] = (state, doc)
         
-        # Process
-        result = self.document_classifier.process(app_state)
+        responses = await self._run_message_batch(requests, poll_interval)
+        for custom_id, (state, doc) in targets.items():
+            if custom_id not in responses:
+                state.add_log(
+                    agent="DataExtractor",
+                    action="extraction_error",
+                    details={"document": doc.file.filename, "error": "Batch request did not succeed"}
+                )
+                continue
+            
+            extraction = self.data_extractor.parse_response(doc, responses[custom_id])
+            state.extracted_data.append(extraction)
+            state.add_log(
+                agent="DataExtractor",
+                action="extract_data",
+                details={
+                    "document": doc.file.filename,
+                    "type": doc.document_type,
+                    "fields_extracted": len(extraction.data),
+                    "confidence": extraction.confidence
+                }
+            )
+        
+        # Stage 3: decisions need per-application RAG lookups, so they run online and concurrently
+        decidable = []
+        for state in active:
+            state.current_stage = "data_extracted"
+            if not any(extraction.confidence > 0.1 for extraction in state.extracted_data):
+                self._fail_batch_application(state, "No data extracted with sufficient confidence")
+                continue
+            decidable.append(state)
+        
+        await asyncio.gather(*(self.admission_agent.aprocess(state) for state in decidable))
         
-        # Convert back to dict
-        state["classified_documents"] = result.classified_documents
-        state["current_stage"] = result.current_stage
-        state["error_message"] = result.error_message
-        state["agent_logs"] = result.agent_logs
-        return state
+        # Checkpointed like online runs, so batch applications are listed and readable too
+        for state in states:
+            await self._checkpoint_batch_state(state)
+        
+        logger.info(f"Batch workflow completed for {len(states)} applications")
+        return states
     
-    def _extract_data_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
-        """Node for data extraction"""
-        # Convert dict to ApplicationState
-        app_state = ApplicationState(
-            application_id=state["application_id"],
-            applicant_id=state["applicant_id"],
-            target_program=state["target_program"],
-            entity=state["entity"],
-            uploaded_files=state["uploaded_files"],
-            classified_documents=state.get("classified_documents", []),
-            extracted_data=state.get("extracted_data", []),
-            admission_decision=state.get("admission_decision"),
-            current_stage=state.get("current_stage", "extracting"),
-            error_message=state.get("error_message"),
-            agent_logs=state.get("agent_logs", []),
-            created_at=state["created_at"]
-        )
+    async def _run_message_batch(self, requests: List[Dict[str, Any]], poll_interval: float) -> Dict[str, Any]:
+        """
+        Submit a message batch, wait for it to end and return succeeded messages by custom_id
+        """
+        if not requests:
+            return {}
+        
+        batch = await self.batch_client.messages.batches.create(requests=requests)
+        logger.info(f"Submitted message batch {batch.id} with {len(requests)} requests")
         
-        # Process
-        result = self.data_extractor.process(app_state)
+        while batch.processing_status != "ended":
+            await asyncio.sleep(poll_interval)
+            batch = await self.batch_client.messages.batches.retrieve(batch.id)
         
-        # Convert back to dict
-        state["extracted_data"] = result.extracted_data
-        state["current_stage"] = result.current_stage
-        state["error_message"] = result.error_message
-        state["agent_logs"] = result.agent_logs
-        return state
+        responses = {}
+        async for entry in await self.batch_client.messages.batches.results(batch.id):
+            if entry.result.type == "succeeded":
+                responses[entry.custom_id] = entry.result.message
+            else:
+                logger.error(f"Batch request {entry.custom_id} finished as {entry.result.type}")
+        
+        return responses
     
-    def _make_decision_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
-        """Node for admission decision"""
-        # Convert dict to ApplicationState
-        app_state = ApplicationState(
-            application_id=state["application_id"],
-            applicant_id=state["applicant_id"],
-            target_program=state["target_program"],
-            entity=state["entity"],
-            uploaded_files=state["uploaded_files"],
-            classified_documents=state.get("classified_documents", []),
-            extracted_data=state.get("extracted_data", []),
-            admission_decision=state.get("admission_decision"),
-            current_stage=state.get("current_stage", "deciding"),
-            error_message=state.get("error_message"),
-            agent_logs=state.get("agent_logs", []),
-            created_at=state["created_at"]
+    async def _checkpoint_batch_state(self, state: ApplicationState):
+        """Store the final state of a batch application as its thread's checkpoint"""
+        checkpoint = empty_checkpoint()
+        checkpoint["channel_values"] = _application_state_values(state)
+        try:
+            await get_checkpointer().aput(
+                {"configurable": {"thread_id": state.application_id}},
+                checkpoint,
+                {"source": "update", "step": -1, "writes": None}
+            )
+        except Exception as e:
+            logger.error(f"Failed to checkpoint batch application {state.application_id}: {e}")
+    
+    def _fail_batch_application(self, state: ApplicationState, error_message: str):
+        """Mark an application in a batch run as failed"""
+        logger.error(f"Error in batch workflow for {state.application_id}: {error_message}")
+        state.error_message = error_message
+        state.current_stage = "error_handled"
+        state.add_log(
+            agent="Workflow",
+            action="handle_error",
+            details={"error": error_message}
         )
+    
+    # Node implementations - return only the keys they update
+    async def _process_document_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Node classifying one uploaded file and extracting its data as soon as it is classified"""
+        application_id = state["application_id"]
         
-        # Process
-        result = self.admission_agent.process(app_state)
+        classification = await self._classify_document(application_id, state["file"])
+        if not classification.get("classified_documents"):
+            return classification
         
-        # Convert back to dict
-        state["admission_decision"] = result.admission_decision
-        state["current_stage"] = result.current_stage
-        state["error_message"] = result.error_message
-        state["agent_logs"] = result.agent_logs
-        return state
+        extraction = await self._extract_document(application_id, classification["classified_documents"][0])
+        return {
+            "classified_documents": classification["classified_documents"],
+            "extracted_data": extraction.get("extracted_data", []),
+            "agent_logs": classification["agent_logs"] + extraction["agent_logs"]
+        }
     
-    def _handle_error_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
-        """Node for error handling"""
-        logger.error(f"Error in workflow: {state.get('error_message')}")
-        state["current_stage"] = "error_handled"
+    async def _classify_document(self, application_id: str, file: DocumentFile) -> Dict[str, Any]:
+        """Classify one uploaded file, returning the state update"""
+        try:
+            classification = await self.document_classifier.classify_document(file)
+        except Exception as e:
+            logger.error(f"Failed to classify {file.filename}: {e}")
+            log = record_log(application_id, "DocumentClassifier", "classification_error", {
+                "file": file.filename,
+                "error": str(e)
+            })
+            return {"agent_logs": [log]}
         
-        # Add error log
-        if "agent_logs" not in state:
-            state["agent_logs"] = []
-        state["agent_logs"].append({
-            "timestamp": datetime.now(),
-            "agent": "Workflow",
-            "action": "handle_error",
-            "details": {"error": state.get("error_message")}
+        log = record_log(application_id, "DocumentClassifier", "classify_document", {
+            "file": file.filename,
+            "classified_as": classification.document_type,
+            "confidence": classification.confidence
         })
+        return {"classified_documents": [classification], "agent_logs": [log]}
+    
+    async def _extract_document(self, application_id: str, classified_doc: ClassifiedDocument) -> Dict[str, Any]:
+        """Extract data from one classified document, returning the state update"""
+        try:
+            extraction = await self.data_extractor.extract_document(classified_doc)
+        except Exception as e:
+            logger.error(f"Data extraction failed for {classified_doc.file.filename}: {e}")
+            log = record_log(application_id, "DataExtractor", "extraction_error", {
+                "document": classified_doc.file.filename,
+                "error": str(e)
+            })
+            return {"agent_logs": [log]}
         
-        return state
+        log = record_log(application_id, "DataExtractor", "extract_data", {
+            "document": classified_doc.file.filename,
+            "type": classified_doc.document_type,
+            "fields_extracted": len(extraction.data),
+            "confidence": extraction.confidence
+        })
+        return {"extracted_data": [extraction], "agent_logs": [log]}
     
-    # Conditional edge functions - now work with dicts
-    def _should_continue_after_classification(self, state: Dict[str, Any]) -> str:
-        """Decide whether to continue after document classification"""
-        if state.get("error_message"):
-            return "error"
+    def _check_documents_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Node joining the document branches: classification, completeness and extraction checks"""
+        logger.info(f"Classified {len(state['classified_documents'])} and extracted {len(state['extracted_data'])} documents")
         
         if not state.get("classified_documents"):
-            state["error_message"] = "No documents were successfully classified"
-            return "error"
+            return {"error_message": "No documents were successfully classified"}
         
         # Check if we have at least some confidently classified documents
-        confident_docs = [
-            doc for doc in state.get("classified_documents", [])
-            if doc.confidence > 0.5
-        ]
+        if not any(doc.confidence > 0.5 for doc in state["classified_documents"]):
+            return {"error_message": "No documents classified with sufficient confidence"}
         
-        if not confident_docs:
-            state["error_message"] = "No documents classified with sufficient confidence"
-            return "error"
-        
-        return "continue"
-    
-    def _should_continue_after_extraction(self, state: Dict[str, Any]) -> str:
-        """Decide whether to continue after data extraction"""
-        if state.get("error_message"):
-            return "error"
+        decision = self.admission_agent.completeness_decision(state["entity"], state["classified_documents"])
+        if decision:
+            logger.info(f"Application {state['application_id']} is missing documents: {', '.join(decision.missing_documents)}")
+            log = record_log(state["application_id"], "AdmissionDecision", "make_decision", {
+                "status": decision.status,
+                "confidence": decision.confidence,
+                "rules_applied": 0
+            })
+            return {"admission_decision": decision, "current_stage": "decision_made", "agent_logs": [log]}
         
         if not state.get("extracted_data"):
-            state["error_message"] = "No data was successfully extracted"
-            return "error"
+            return {"error_message": "No data was successfully extracted"}
         
         # Check if we have at least some data with reasonable confidence
         # Lower threshold since we're extracting from real documents
-        confident_extractions = [
-            extraction for extraction in state.get("extracted_data", [])
-            if extraction.confidence > 0.1  # Lowered from 0.3
-        ]
+        if not any(extraction.confidence > 0.1 for extraction in state["extracted_data"]):  # Lowered from 0.3
+            return {"error_message": "No data extracted with sufficient confidence"}
+        
+        return {"current_stage": "data_extracted"}
+    
+    async def _make_decision_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Node for admission decision"""
+        application_id = state["application_id"]
+        logger.info(f"Making admission decision for application {application_id}")
+        
+        try:
+            decision, cached = await self.admission_agent.decide(
+                state["target_program"], state["entity"], state["classified_documents"], state["extracted_data"]
+            )
+        except Exception as e:
+            logger.error(f"Decision making failed: {e}")
+            log = record_log(application_id, "AdmissionDecision", "decision_error", {"error": str(e)})
+            return {"error_message": str(e), "current_stage": "error", "agent_logs": [log]}
+        
+        logs = []
+        if cached:
+            logs.append(record_log(application_id, "AdmissionDecision", "decision_cache_hit", {"status": decision.status}))
+        logs.append(record_log(application_id, "AdmissionDecision", "make_decision", {
+            "status": decision.status,
+            "confidence": decision.confidence,
+            "rules_applied": len(decision.applied_rules)
+        }))
+        
+        logger.info(f"Decision made: {decision.status} (confidence: {decision.confidence})")
+        return {"admission_decision": decision, "current_stage": "decision_made", "agent_logs": logs}
+    
+    def _handle_error_node(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Node for error handling"""
+        logger.error(f"Error in workflow: {state.get('error_message')}")
+        
+        # Add error log
+        log = record_log(state["application_id"], "Workflow", "handle_error", {"error": state.get("error_message")})
+        return {"current_stage": "error_handled", "agent_logs": [log]}
+    
+    # Conditional edge functions - now work with dicts
+    def _route_uploaded_files(self, state: Dict[str, Any]) -> Union[str, List[Send]]:
+        """Send every uploaded file to its own classify-then-extract branch"""
+        logger.info(f"Classifying {len(state['uploaded_files'])} documents for application {state['application_id']}")
         
-        if not confident_extractions:
-            state["error_message"] = "No data extracted with sufficient confidence"
+        if not state["uploaded_files"]:
+            return "check_documents"
+        
+        return [
+            Send("process_document", {"application_id": state["application_id"], "file": file})
+            for file in state["uploaded_files"]
+        ]
+    
+    def _should_continue_after_documents(self, state: Dict[str, Any]) -> str:
+        """Decide whether to continue after the document branches joined"""
+        if state.get("error_message"):
             return "error"
         
+        if state.get("admission_decision"):
+            return "incomplete"
+        
         return "continue"
 
-# Convenience function to create and run workflow
-def process_admission_application(
+def _application_state_values(state: ApplicationState) -> Dict[str, Any]:
+    """Workflow state values of an ApplicationState"""
+    return {
+        "application_id": state.application_id,
+        "applicant_id": state.applicant_id,
+        "target_program": state.target_program,
+        "entity": state.entity,
+        "uploaded_files": state.uploaded_files,
+        "classified_documents": state.classified_documents,
+        "extracted_data": state.extracted_data,
+        "admission_decision": state.admission_decision,
+        "current_stage": state.current_stage,
+        "error_message": state.error_message,
+        "agent_logs": state.agent_logs,
+        "created_at": state.created_at
+    }
+
+def _application_state_from_values(values: Dict[str, Any]) -> ApplicationState:
+    """Build an ApplicationState from workflow state values"""
+    return ApplicationState(
+        application_id=values["application_id"],
+        applicant_id=values["applicant_id"],
+        target_program=values["target_program"],
+        entity=values["entity"],
+        uploaded_files=values["uploaded_files"],
+        classified_documents=values.get("classified_documents", []),
+        extracted_data=values.get("extracted_data", []),
+        admission_decision=values.get("admission_decision"),
+        current_stage=values.get("current_stage", "completed"),
+        error_message=values.get("error_message"),
+        agent_logs=values.get("agent_logs", []),
+        created_at=values["created_at"]
+    )
+
+async def get_application_state(application_id: str) -> Optional[ApplicationState]:
+    """
+    Load the latest checkpointed state of an application, or None if it is unknown
+    """
+    checkpoint_tuple = await get_checkpointer().aget_tuple({"configurable": {"thread_id": application_id}})
+    if checkpoint_tuple is None:
+        return None
+    return _application_state_from_values(checkpoint_tuple.checkpoint["channel_values"])
+
+async def list_application_states() -> List[ApplicationState]:
+    """
+    Load the latest checkpointed state of every application
+    """
+    checkpointer = get_checkpointer()
+    await checkpointer.setup()
+    
+    # Only the latest checkpoint of each thread is read and deserialized, newest application first
+    query = """
+        SELECT checkpoints.checkpoint FROM checkpoints
+        JOIN (SELECT thread_id, MAX(thread_ts) AS thread_ts FROM checkpoints GROUP BY thread_id) AS latest
+        USING (thread_id, thread_ts)
+        ORDER BY checkpoints.thread_ts DESC
+    """
+    async with checkpointer.conn.execute(query) as cursor:
+        rows = await cursor.fetchall()
+    
+    return [_application_state_from_values(checkpointer.serde.loads(row[0])["channel_values"]) for row in rows]
+
+@functools.cache
+def get_workflow() -> AdmissionWorkflow:
+    """
+    Shared workflow - agents and the compiled graph are built once, on first use
+    """
+    return AdmissionWorkflow()
+
+# Convenience function to run the workflow
+async def process_admission_application(
     application_id: str,
     applicant_id: str, 
     target_program: str,
@@ -299,8 +539,26 @@ def process_admission_application(
         uploaded_files=uploaded_files
     )
     
-    # Create and run workflow
-    workflow = AdmissionWorkflow()
-    result = workflow.process_application(state)
+    result = await get_workflow().process_application(state)
+    
+    return result
+
+async def process_admission_applications(states: List[ApplicationState]) -> List[ApplicationState]:
+    """
+    Process several applications: batch-SLA applications go through the
+    Message Batches API, interactive ones through the online workflow
+    """
+    workflow = get_workflow()
+    
+    batch_states = [state for state in states if state.sla == "batch"]
+    interactive_states = [state for state in states if state.sla != "batch"]
+    
+    # The batch run polls for hours; interactive applications proceed on the same loop meanwhile
+    batch_run = workflow.process_batch(batch_states) if batch_states else asyncio.sleep(0)
+    _, *interactive_results = await asyncio.gather(
+        batch_run,
+        *(workflow.process_application(state) for state in interactive_states)
+    )
     
-    return result
\ No newline at end of file
+    processed = iter(interactive_results)
+    return [state if state.sla == "batch" else next(processed) for state in states]
\ No newline at end of file
@@ -0,0 +1,78 @@
+"""
+Batch processing of admission applications
+Runs non-interactive applications through the Message Batches API
+
+Usage: python batch.py applications.json
+
+applications.json lists the applications to process:
+[{"applicant_id": "...", "target_program": "...", "entity": "DE", "files": ["path/to/file.pdf", ...]}]
+"""
+import asyncio
+import json
+import logging
+import mimetypes
+import os
+import sys
+import uuid
+from typing import Any, Dict
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv(dotenv_path="../.env")
+
+from agents.workflow import process_admission_applications, close_checkpointer
+from agents.state import ApplicationState, DocumentFile
+from agents.document_text import extract_pdf_text, MAX_TEXT_PAGES
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _load_document(file_path: str) -> DocumentFile:
+    """Describe one application file and extract its text"""
+    text_content = None
+    if file_path.lower().endswith('.pdf'):
+        try:
+            text_content = extract_pdf_text(file_path, MAX_TEXT_PAGES)
+        except Exception as e:
+            logger.warning(f"Text extraction failed for {file_path}: {e}")
+    
+    return DocumentFile(
+        file_id=f"DOC-{uuid.uuid4().hex[:6]}",
+        filename=os.path.basename(file_path),
+        file_type=mimetypes.guess_type(file_path)[0] or "application/octet-stream",
+        file_path=file_path,
+        size_bytes=os.path.getsize(file_path),
+        text_content=text_content
+    )
+
+def _load_application(spec: Dict[str, Any]) -> ApplicationState:
+    """Build a batch application from its JSON description"""
+    return ApplicationState(
+        application_id=spec.get("application_id") or f"APP-{uuid.uuid4().hex[:8]}",
+        applicant_id=spec["applicant_id"],
+        target_program=spec["target_program"],
+        entity=spec["entity"],
+        uploaded_files=[_load_document(path) for path in spec["files"]],
+        sla="batch"
+    )
+
+async def main(applications_path: str):
+    with open(applications_path, encoding="utf-8") as f:
+        states = [_load_application(spec) for spec in json.load(f)]
+    
+    logger.info(f"Processing {len(states)} applications in batch mode")
+    try:
+        results = await process_admission_applications(states)
+    finally:
+        await close_checkpointer()
+    
+    for state in results:
+        decision = state.admission_decision.status if state.admission_decision else "Pending"
+        print(f"{state.application_id}: {state.current_stage} - {decision}")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(1)
+    asyncio.run(main(sys.argv[1]))
\ No newline at end of file
@@ -0,0 +1,66 @@
+"""
+Shared Anthropic clients
+Agents and the RAG retriever reuse one pooled HTTP connection pool instead of one per caller
+"""
+import asyncio
+import os
+import threading
+import weakref
+import anthropic
+import httpx
+
+# Validated once when the clients module is first imported
+ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+if not ANTHROPIC_API_KEY:
+    raise ValueError("ANTHROPIC_API_KEY not found in environment")
+
+HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60)
+HTTP_TIMEOUT = httpx.Timeout(60, connect=5)
+
+# Upper bound on in-flight Claude requests per event loop - keeps bursts within Anthropic concurrency limits
+MAX_CONCURRENT_REQUESTS = 8
+
+_client_lock = threading.Lock()
+_client = None
+
+# Async connections belong to the event loop that opened them, so async clients are per loop
+_async_clients = weakref.WeakKeyDictionary()
+_request_semaphores = weakref.WeakKeyDictionary()
+
+def get_client() -> anthropic.Anthropic:
+    """
+    Process-wide synchronous Anthropic client with keep-alive connection pooling
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = anthropic.Anthropic(
+                api_key=ANTHROPIC_API_KEY,
+                http_client=httpx.Client(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+            )
+        return _client
+
+def get_async_client() -> anthropic.AsyncAnthropic:
+    """
+    Async Anthropic client for the running event loop, with keep-alive connection pooling
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = anthropic.AsyncAnthropic(
+            api_key=ANTHROPIC_API_KEY,
+            http_client=httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+        )
+        _async_clients[loop] = client
+    return client
+
+def get_request_semaphore() -> asyncio.Semaphore:
+    """
+    Semaphore bounding concurrent Claude requests on the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = _request_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        _request_semaphores[loop] = semaphore
+    return semaphore
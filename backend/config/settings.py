@@ -12,15 +12,24 @@ class Settings(BaseSettings):
     
     # Free Local Embeddings
     EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"  # Free sentence transformer model
+    EMBEDDING_BACKEND: str = "sentence-transformers"  # or "fastembed" - ONNX inference without PyTorch (needs fastembed)
+    EMBEDDING_ONNX_INT8: bool = False  # int8 ONNX Runtime inference on CPU (needs optimum[onnxruntime])
+    EMBEDDING_ONNX_DIR: str = "./onnx_models"
+    EMBEDDING_WORKERS: int = 4  # processes for large CPU embedding batches (index builds), 1 disables
+    PRELOAD_EMBEDDINGS: bool = False  # load the model at import, for gunicorn --preload copy-on-write sharing
+    EMBEDDING_CACHE_PATH: str = "./embedding_cache.db"  # SQLite cache of computed embeddings
     
     # RAG Configuration
     CHUNK_SIZE: int = 1500
     CHUNK_OVERLAP: int = 200
-    RETRIEVAL_K: int = 5
+    RETRIEVAL_K: int = 3  # chunks per handbook question - each one adds to the Claude prompt
+    HANDBOOK_INDEX_INT8: bool = False  # int8-quantized in-memory search matrix, 4x smaller, slightly slower scoring
     
     # Paths
     HANDBOOK_PATH: str = "data/Leitfaden.pdf"
     CHROMA_PERSIST_DIR: str = "./chroma_db"
+    CHECKPOINT_DB_PATH: str = "./applications.db"  # LangGraph checkpoints, one thread per application
+    AGENT_LOG_DIR: str = "./logs"  # append-only JSONL agent logs, one file per application
     
     class Config:
         env_file = ".env"
@@ -4,10 +4,14 @@ Query system for the 245-page admission handbook
 """
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Dict, Any, List, Optional
+import asyncio
 import os
 import uuid
+import aiofiles
+import orjson
 from datetime import datetime
 import logging
 from dotenv import load_dotenv
@@ -17,8 +21,11 @@ load_dotenv(dotenv_path="../.env")
 
 # Import RAG system and agents
 from rag.retriever import AdmissionRulesRetriever
-from agents.workflow import process_admission_application
-from agents.state import ApplicationState, DocumentFile
+from rag.free_embeddings import get_free_embeddings
+from config.settings import settings
+from agents.workflow import process_admission_application, get_application_state, list_application_states, close_checkpointer
+from agents.state import DocumentFile
+from agents.document_text import extract_pdf_text, MAX_TEXT_PAGES
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -28,7 +35,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="IU Admissions RAG System",
     version="1.0.0",
-    description="RAG system for querying 245-page admission handbook"
+    description="RAG system for querying 245-page admission handbook",
+    default_response_class=ORJSONResponse  # orjson serializes datetimes natively and much faster
 )
 
 # CORS middleware for frontend
@@ -43,8 +51,22 @@ app.add_middleware(
 # Initialize RAG system
 rag_system = AdmissionRulesRetriever()
 
-# In-memory storage for demo (use database in production)
-APPLICATIONS: Dict[str, ApplicationState] = {}
+# The vector store is built lazily, so under gunicorn --preload the model must be loaded
+# here, in the master, for forked workers to share its weights copy-on-write
+if settings.PRELOAD_EMBEDDINGS:
+    get_free_embeddings()
+
+# Uploads are written to disk in chunks of this size, one write syscall per chunk
+UPLOAD_CHUNK_SIZE = 1 << 20
+UPLOAD_ROOT = "./uploads"
+
+# Created once, so each application only needs a single mkdir
+os.makedirs(UPLOAD_ROOT, exist_ok=True)
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Close the workflow checkpoint database"""
+    await close_checkpointer()
 
 # Request/Response models
 class RuleQueryRequest(BaseModel):
@@ -84,7 +106,8 @@ async def initialize_rag(request: InitializeRequest):
     """Initialize the RAG system with the 245-page handbook"""
     try:
         logger.info("Initializing RAG system...")
-        rag_system.initialize(force_reload=request.force_reload)
+        # Indexing is CPU-bound, so it runs in a worker thread to keep the event loop responsive
+        await asyncio.to_thread(rag_system.initialize, force_reload=request.force_reload)
         return {
             "status": "success",
             "message": "RAG system initialized with 245-page handbook",
@@ -99,12 +122,36 @@ async def query_handbook(request: RuleQueryRequest):
     """Query the admission handbook directly"""
     try:
         logger.info(f"Processing query: {request.question[:100]}...")
-        result = rag_system.query_admission_rules(request.question)
+        result = await rag_system.aquery_admission_rules(request.question)
         return result
     except Exception as e:
         logger.error(f"Handbook query failed: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/query-handbook/stream")
+async def query_handbook_stream(request: RuleQueryRequest):
+    """Query the admission handbook, streaming the sources first and then the answer as NDJSON"""
+    logger.info(f"Processing streaming query: {request.question[:100]}...")
+    events = rag_system.astream_admission_rules(request.question)
+    
+    # Retrieval errors still surface as a 500 - only the first event is awaited up front
+    try:
+        first = await anext(events)
+    except Exception as e:
+        logger.error(f"Handbook query failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def ndjson():
+        yield orjson.dumps(first) + b"\n"
+        try:
+            async for event in events:
+                yield orjson.dumps(event) + b"\n"
+        except Exception as e:
+            logger.error(f"Handbook query failed: {str(e)}")
+            yield orjson.dumps({"error": str(e)}) + b"\n"
+    
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
 @app.get("/handbook-status")
 async def handbook_status():
     """Get status of the handbook processing"""
@@ -117,7 +164,7 @@ async def handbook_status():
         }
     
     try:
-        if rag_system.vector_store.vector_store is None:
+        if not rag_system.is_initialized:
             return {
                 "status": "not_initialized",
                 "message": "RAG system not initialized. Call /initialize-rag first"
@@ -149,32 +196,16 @@ async def submit_application(
     
     try:
         # Save uploaded files
-        uploaded_files = []
-        upload_dir = f"./uploads/{application_id}"
-        os.makedirs(upload_dir, exist_ok=True)
+        upload_dir = os.path.join(UPLOAD_ROOT, application_id)
+        await asyncio.to_thread(os.mkdir, upload_dir)
         
-        for file in files:
-            file_path = os.path.join(upload_dir, file.filename)
-            
-            # Save file
-            with open(file_path, "wb") as f:
-                content = await file.read()
-                f.write(content)
-            
-            # Create DocumentFile object
-            doc_file = DocumentFile(
-                file_id=f"DOC-{uuid.uuid4().hex[:6]}",
-                filename=file.filename,
-                file_type=file.content_type,
-                file_path=file_path,
-                size_bytes=len(content)
-            )
-            uploaded_files.append(doc_file)
+        # Files are independent, so they are saved and parsed concurrently
+        uploaded_files = list(await asyncio.gather(*(_save_upload(file, upload_dir) for file in files)))
         
         logger.info(f"Processing application {application_id} with {len(uploaded_files)} files")
         
         # Process through agent workflow (connected to your RAG system!)
-        result_state = process_admission_application(
+        result_state = await process_admission_application(
             application_id=application_id,
             applicant_id=applicant_id,
             target_program=target_program,
@@ -182,9 +213,6 @@ async def submit_application(
             uploaded_files=uploaded_files
         )
         
-        # Store result
-        APPLICATIONS[application_id] = result_state
-        
         logger.info(f"Application {application_id} processed: {result_state.current_stage}")
         
         return ApplicationResponse(
@@ -197,15 +225,46 @@ async def submit_application(
         logger.error(f"Application submission failed: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _save_upload(file: UploadFile, upload_dir: str) -> DocumentFile:
+    """Stream one uploaded file to disk and extract its text"""
+    # Files are saved concurrently, so the file id keeps uploads with the same name apart
+    file_id = f"DOC-{uuid.uuid4().hex[:6]}"
+    file_path = os.path.join(upload_dir, f"{file_id}_{file.filename}")
+    
+    # Stream the file to disk in 1 MiB chunks instead of buffering it in memory
+    size_bytes = 0
+    async with aiofiles.open(file_path, "wb") as out:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await out.write(chunk)
+            size_bytes += len(chunk)
+    
+    # Extract text once so classifier and extractor don't re-parse the PDF.
+    # Parsed in a worker thread to keep the event loop free for other requests.
+    text_content = None
+    if file_path.lower().endswith('.pdf'):
+        try:
+            text_content = await asyncio.to_thread(extract_pdf_text, file_path, MAX_TEXT_PAGES)
+        except Exception as e:
+            logger.warning(f"Text extraction failed for {file.filename}: {e}")
+    
+    return DocumentFile(
+        file_id=file_id,
+        filename=file.filename,
+        file_type=file.content_type,
+        file_path=file_path,
+        size_bytes=size_bytes,
+        text_content=text_content
+    )
+
 @app.get("/application/{application_id}", response_model=ApplicationStatusResponse)
 async def get_application_status(application_id: str):
     """Get detailed application status and agent decision"""
     
-    if application_id not in APPLICATIONS:
+    # Read from the workflow checkpoints
+    state = await get_application_state(application_id)
+    if state is None:
         raise HTTPException(status_code=404, detail="Application not found")
     
-    state = APPLICATIONS[application_id]
-    
     # Prepare decision data
     decision_data = None
     if state.admission_decision:
@@ -222,16 +281,16 @@ async def get_application_status(application_id: str):
         application_id=application_id,
         current_stage=state.current_stage,
         decision=decision_data,
-        logs=state.agent_logs
+        logs=[log.to_dict() for log in state.agent_logs]
     )
 
 @app.get("/applications")
 async def list_applications():
     """List all processed applications"""
     summaries = []
-    for app_id, state in APPLICATIONS.items():
+    for state in await list_application_states():
         summary = {
-            "application_id": app_id,
+            "application_id": state.application_id,
             "applicant_id": state.applicant_id,
             "target_program": state.target_program,
             "entity": state.entity,
@@ -258,4 +317,5 @@ if __name__ == "__main__":
     print("1. POST /initialize-rag  (processes 245 pages - takes 3-4 min)")
     print("2. POST /query-handbook  (ask questions about admission rules)")
     print()
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # uvloop and httptools ship with uvicorn[standard]
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools")
\ No newline at end of file
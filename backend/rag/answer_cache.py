@@ -0,0 +1,130 @@
+"""
+Answer Cache
+Reuses handbook answers for repeated and paraphrased questions
+"""
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Minimum cosine similarity for a paraphrase hit
+SIMILARITY_THRESHOLD = 0.95
+# Cached answers expire so handbook re-indexing and prompt changes are picked up
+ANSWER_TTL_SECONDS = 24 * 60 * 60
+
+# Key entities for the lexical guardrail: numbers, and capitalized words past the
+# first one (programs, degrees, languages, acronyms)
+_NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)*")
+_WORD_PATTERN = re.compile(r"\w+")
+
+class AnswerCache:
+    """
+    Two-level cache for handbook answers: an exact match on the normalized
+    question, then a semantic match on the question embedding. Semantic hits
+    must also mention the same key entities, since "MBA" and "MSc" questions
+    embed almost identically.
+    """
+    
+    def __init__(self, embeddings, model: str, max_entries: int = 1000):
+        self.embeddings = embeddings
+        self.model = model
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        
+        # key -> (answer, entities, normalized question embedding, stored at)
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], FrozenSet[str], np.ndarray, float]]" = OrderedDict()
+        # Stacked embeddings of all entries, rebuilt on writes - lookups are a single matrix product
+        self._keys = []
+        self._matrix = None
+    
+    def get(self, question: str) -> Optional[Dict[str, Any]]:
+        """
+        Return a cached answer for the question or a close paraphrase, if any
+        """
+        key = self._make_key(question)
+        now = time.time()
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[3] < ANSWER_TTL_SECONDS:
+                    self._entries.move_to_end(key)
+                    logger.info("Answer cache hit (exact)")
+                    return dict(entry[0], question=question)
+                self._remove_expired(now)
+            keys, matrix = self._keys, self._matrix
+        
+        if matrix is None:
+            return None
+        
+        scores = matrix @ self._embed(question)
+        best = int(np.argmax(scores))
+        similarity = float(scores[best])
+        if similarity < SIMILARITY_THRESHOLD:
+            return None
+        
+        with self._lock:
+            entry = self._entries.get(keys[best])
+            if entry is not None and now - entry[3] >= ANSWER_TTL_SECONDS:
+                self._remove_expired(now)
+                entry = None
+        if entry is None:
+            return None
+        
+        # Lexical guardrail: a paraphrase must be about the same things
+        if entry[1] != self._entities(question):
+            logger.debug(f"Answer cache near miss (similarity {similarity:.3f}): entities differ")
+            return None
+        
+        logger.info(f"Answer cache hit (semantic, similarity {similarity:.3f})")
+        return dict(entry[0], question=question)
+    
+    def put(self, question: str, answer: Dict[str, Any]):
+        """
+        Store the answer to a question
+        """
+        key = self._make_key(question)
+        vector = self._embed(question)
+        
+        now = time.time()
+        
+        with self._lock:
+            self._entries[key] = (answer, self._entities(question), vector, now)
+            self._entries.move_to_end(key)
+            
+            # Evict least recently used entries
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            
+            # Drops expired entries and rebuilds the lookup matrix
+            self._remove_expired(now, force_rebuild=True)
+    
+    def _remove_expired(self, now: float, force_rebuild: bool = False):
+        """
+        Drop expired entries and rebuild the lookup matrix if anything changed; caller holds the lock
+        """
+        expired = [key for key, entry in self._entries.items() if now - entry[3] >= ANSWER_TTL_SECONDS]
+        for key in expired:
+            del self._entries[key]
+        
+        if expired or force_rebuild:
+            self._keys = list(self._entries)
+            self._matrix = np.stack([entry[2] for entry in self._entries.values()]) if self._entries else None
+    
+    def _make_key(self, question: str) -> str:
+        # Cached answers are only valid for the model that produced them
+        return f"{self.model}:{' '.join(question.lower().split())}"
+    
+    def _entities(self, question: str) -> FrozenSet[str]:
+        words = _WORD_PATTERN.findall(question)
+        capitalized = {word for word in words[1:] if len(word) > 1 and word[0].isupper()}
+        return frozenset(capitalized) | frozenset(_NUMBER_PATTERN.findall(question))
+    
+    def _embed(self, question: str) -> np.ndarray:
+        vector = self.embeddings.embed_query_array(question)
+        return vector / np.linalg.norm(vector)
\ No newline at end of file
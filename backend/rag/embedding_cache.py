@@ -0,0 +1,171 @@
+"""
+Persistent Embedding Cache
+Stores document embeddings in SQLite so unchanged texts are never re-embedded
+"""
+import functools
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# Keys per SQLite "IN (...)" lookup - stays under the default host parameter limit
+LOOKUP_BATCH_SIZE = 500
+
+# Query embeddings memoized in memory - free-text questions and profiles are not worth persisting
+QUERY_CACHE_SIZE = 1024
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper with an on-disk SHA-256 keyed cache for documents and a bounded
+    in-memory LRU for queries. Vectors stay NumPy arrays internally and are converted to
+    lists only for LangChain callers.
+    """
+    
+    def __init__(self, embeddings: Embeddings, cache_path: str, namespace: str):
+        self.embeddings = embeddings
+        self.namespace = namespace
+        
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        
+        self.cache_path = cache_path
+        
+        # Shared by worker threads, so access is serialized with a lock
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        
+        # text -> query embedding, least recently used first
+        self._queries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._queries_lock = threading.Lock()
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a list of documents
+        """
+        return self.embed_documents_array(texts).tolist()
+    
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a single query
+        """
+        return self.embed_query_array(text).tolist()
+    
+    def embed_documents_array(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed a list of documents as one float32 matrix, computing only the ones not in the cache
+        """
+        keys = [self._key(text) for text in texts]
+        vectors = self._load(keys)
+        
+        # Partition into hits and misses - each distinct missing text is embedded once
+        misses: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in misses:
+                misses[key] = text
+        
+        if misses:
+            logger.debug(f"Embedding cache: {len(texts) - len(misses)} hits, {len(misses)} misses")
+            computed = self.embeddings.embed_documents_array(list(misses.values()))
+            new_vectors = dict(zip(misses, computed))
+            self._store(new_vectors)
+            vectors.update(new_vectors)
+        
+        # Merge back in the original order
+        if not keys:
+            return np.empty((0, self._dimension), dtype=np.float32)
+        return np.stack([vectors[key] for key in keys])
+    
+    def embed_query_array(self, text: str) -> np.ndarray:
+        """
+        Embed a single query as a float32 vector, memoized in memory only
+        """
+        return self.embed_queries_array([text])[0]
+    
+    def embed_queries_array(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed several queries as one float32 matrix. Queries are memoized in a bounded
+        in-memory LRU and never written to the SQLite cache.
+        """
+        vectors: Dict[str, np.ndarray] = {}
+        with self._queries_lock:
+            for text in texts:
+                vector = self._queries.get(text)
+                if vector is not None:
+                    self._queries.move_to_end(text)
+                    vectors[text] = vector
+        
+        misses = [text for text in dict.fromkeys(texts) if text not in vectors]
+        if misses:
+            computed = dict(zip(misses, self.embeddings.embed_documents_array(misses)))
+            vectors.update(computed)
+            with self._queries_lock:
+                self._queries.update(computed)
+                while len(self._queries) > QUERY_CACHE_SIZE:
+                    self._queries.popitem(last=False)
+        
+        if not texts:
+            return np.empty((0, self._dimension), dtype=np.float32)
+        return np.stack([vectors[text] for text in texts])
+    
+    @functools.cached_property
+    def _dimension(self) -> int:
+        """
+        Embedding size, for correctly shaped empty results - probed once with the model
+        """
+        return len(self.embeddings.embed_query_array("dimension"))
+    
+    def _key(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.namespace}\0{text}".encode("utf-8")).digest()[:16]
+    
+    def _load(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """
+        Fetch cached vectors for the given keys
+        """
+        unique_keys = list(dict.fromkeys(keys))
+        vectors = {}
+        
+        with self._lock:
+            for start in range(0, len(unique_keys), LOOKUP_BATCH_SIZE):
+                batch = unique_keys[start:start + LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection().execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, vec in rows:
+                    vectors[key] = np.frombuffer(vec, dtype=np.float32)
+        
+        return vectors
+    
+    def _store(self, vectors: Dict[bytes, np.ndarray]):
+        """
+        Persist newly computed vectors
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)",
+                [(key, vector.tobytes()) for key, vector in vectors.items()]
+            )
+            conn.commit()
+    
+    def _connection(self) -> sqlite3.Connection:
+        """
+        SQLite connection for the current process - a connection must not be used across fork,
+        so forked workers open their own. Called with the lock held.
+        """
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.cache_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vec BLOB NOT NULL)")
+            self._conn.commit()
+            self._conn_pid = os.getpid()
+        return self._conn
\ No newline at end of file
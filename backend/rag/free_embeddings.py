@@ -2,13 +2,37 @@
 Free Local Embeddings using Sentence Transformers
 No API keys required - completely free!
 """
+import functools
+import json
 import logging
+import os
+import shutil
 from typing import List
-from sentence_transformers import SentenceTransformer
+import numpy as np
 from langchain.embeddings.base import Embeddings
+from config.settings import settings
+from .embedding_cache import CachedEmbeddings
+
+# Optional: int8 ONNX Runtime inference
+try:
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+    from huggingface_hub import hf_hub_download
+except ImportError:
+    ORTModelForFeatureExtraction = None
+
+# Optional: ONNX Runtime embeddings through FastEmbed, no PyTorch model in memory
+try:
+    from fastembed import TextEmbedding
+except ImportError:
+    TextEmbedding = None
 
 logger = logging.getLogger(__name__)
 
+# Texts per worker process below which a multi-process encode is not worth the model load in each worker
+MIN_TEXTS_PER_WORKER = 256
+
 class FreeSentenceTransformerEmbeddings(Embeddings):
     """
     Free local embeddings using Sentence Transformers
@@ -18,28 +42,230 @@ class FreeSentenceTransformerEmbeddings(Embeddings):
         self.model_name = model_name or "all-MiniLM-L6-v2"
         logger.info(f"Loading free embedding model: {self.model_name}")
         
-        # Load the model locally (downloads once, then cached)
-        self.model = SentenceTransformer(self.model_name)
-        logger.info("Free embedding model loaded successfully!")
+        # Imported here so the FastEmbed backend never loads PyTorch
+        import torch
+        from sentence_transformers import SentenceTransformer
+        
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.batch_size = 128 if self.device == "cuda" else 64
+        
+        # int8 ONNX Runtime roughly doubles CPU throughput; PyTorch stays the fallback
+        self.model = None
+        self.onnx_model = None
+        if settings.EMBEDDING_ONNX_INT8 and self.device == "cpu":
+            if ORTModelForFeatureExtraction is None:
+                logger.warning("EMBEDDING_ONNX_INT8 is set but optimum[onnxruntime] is not installed - using PyTorch")
+            else:
+                self._load_onnx_int8()
+        
+        # The PyTorch model is only loaded when it is used, so the int8 path keeps just the small model in memory
+        if self.onnx_model is None:
+            # Load the model locally (downloads once, then cached)
+            self.model = SentenceTransformer(self.model_name, device=self.device)
+        
+        backend = "onnxruntime-int8" if self.onnx_model else self.device
+        logger.info(f"Free embedding model loaded successfully on {backend}!")
+        
+        # int8 vectors differ slightly from FP32 ones, so they are cached separately
+        self.model_id = f"{self.model_name}-onnx-int8" if self.onnx_model else self.model_name
+    
+    def _load_onnx_int8(self):
+        """
+        Export the model to ONNX and quantize it to int8 once, then load the quantized model
+        """
+        model_id = f"sentence-transformers/{self.model_name}"
+        model_dir = os.path.join(settings.EMBEDDING_ONNX_DIR, f"{self.model_name}-int8")
+        
+        try:
+            if not os.path.exists(os.path.join(model_dir, "model_quantized.onnx")):
+                logger.info(f"Exporting {model_id} to int8 ONNX in {model_dir}")
+                onnx_model = ORTModelForFeatureExtraction.from_pretrained(
+                    model_id, export=True, provider="CPUExecutionProvider"
+                )
+                quantizer = ORTQuantizer.from_pretrained(onnx_model)
+                quantizer.quantize(
+                    save_dir=model_dir,
+                    quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+                )
+                AutoTokenizer.from_pretrained(model_id).save_pretrained(model_dir)
+            
+            self.onnx_max_seq_length = self._read_max_seq_length(model_id, model_dir)
+            self.onnx_model = ORTModelForFeatureExtraction.from_pretrained(
+                model_dir, file_name="model_quantized.onnx", provider="CPUExecutionProvider"
+            )
+            self.onnx_tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        except Exception as e:
+            logger.warning(f"Failed to load int8 ONNX model, using PyTorch: {e}")
+            self.onnx_model = None
+    
+    def _read_max_seq_length(self, model_id: str, model_dir: str) -> int:
+        """
+        SentenceTransformer's truncation length, kept next to the ONNX model so both paths truncate alike
+        """
+        config_path = os.path.join(model_dir, "sentence_bert_config.json")
+        if not os.path.exists(config_path):
+            shutil.copy(hf_hub_download(model_id, "sentence_bert_config.json"), config_path)
+        
+        with open(config_path, encoding="utf-8") as f:
+            return json.load(f)["max_seq_length"]
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """
         Embed a list of documents
         """
+        return self.embed_documents_array(texts).tolist()
+    
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a single query
+        """
+        return self.embed_query_array(text).tolist()
+    
+    def embed_documents_array(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed a list of documents as one float32 matrix, without boxing every float
+        """
         logger.debug(f"Embedding {len(texts)} documents")
-        embeddings = self.model.encode(texts, convert_to_tensor=False)
-        return embeddings.tolist()
+        return self._encode(texts)
+    
+    def embed_query_array(self, text: str) -> np.ndarray:
+        """
+        Embed a single query as a float32 vector
+        """
+        logger.debug("Embedding query")
+        return self._encode([text])[0]
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode texts as unit-length float32 vectors, so inner product equals cosine similarity
+        """
+        if self.onnx_model is not None:
+            return self._encode_onnx(texts)
+        
+        workers = min(settings.EMBEDDING_WORKERS, os.cpu_count() or 1, len(texts) // MIN_TEXTS_PER_WORKER)
+        if self.device == "cpu" and workers > 1:
+            return self._encode_parallel(texts, workers)
+        
+        embeddings = self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        return embeddings.astype(np.float32, copy=False)
+    
+    def _encode_parallel(self, texts: List[str], workers: int) -> np.ndarray:
+        """
+        Encode a large batch (a handbook re-index) across worker processes, each with its own model copy
+        """
+        logger.info(f"Embedding {len(texts)} texts in {workers} processes")
+        pool = self.model.start_multi_process_pool(target_devices=["cpu"] * workers)
+        try:
+            embeddings = self.model.encode_multi_process(
+                texts,
+                pool,
+                batch_size=self.batch_size,
+                chunk_size=-(-len(texts) // workers)
+            )
+        finally:
+            self.model.stop_multi_process_pool(pool)
+        
+        # The multi-process encoder does not normalize
+        embeddings = embeddings.astype(np.float32, copy=False)
+        return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    
+    def _encode_onnx(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode with the int8 ONNX model, mirroring SentenceTransformer's mean pooling and normalization
+        """
+        import torch
+        
+        batches = []
+        for start in range(0, len(texts), self.batch_size):
+            inputs = self.onnx_tokenizer(
+                texts[start:start + self.batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.onnx_max_seq_length,
+                return_tensors="pt"
+            )
+            with torch.inference_mode():
+                token_embeddings = self.onnx_model(**inputs).last_hidden_state
+                mask = inputs["attention_mask"].unsqueeze(-1).to(token_embeddings.dtype)
+                pooled = (token_embeddings * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                batches.append(torch.nn.functional.normalize(pooled, p=2, dim=1).numpy())
+        
+        if not batches:
+            return np.empty((0, self.onnx_model.config.hidden_size), dtype=np.float32)
+        return np.concatenate(batches).astype(np.float32, copy=False)
+
+class FastEmbedEmbeddings(Embeddings):
+    """
+    Local embeddings through FastEmbed's ONNX Runtime models - same model, same 384-dim output
+    """
+    
+    def __init__(self, model_name: str = None):
+        self.model_name = model_name or "all-MiniLM-L6-v2"
+        logger.info(f"Loading FastEmbed model: {self.model_name}")
+        
+        self.model = TextEmbedding(f"sentence-transformers/{self.model_name}")
+        self.batch_size = 64
+        
+        logger.info("FastEmbed model loaded successfully on onnxruntime!")
+        
+        # ONNX vectors differ slightly from PyTorch ones, so they are cached separately
+        self.model_id = f"{self.model_name}-fastembed"
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a list of documents
+        """
+        return self.embed_documents_array(texts).tolist()
     
     def embed_query(self, text: str) -> List[float]:
         """
         Embed a single query
         """
+        return self.embed_query_array(text).tolist()
+    
+    def embed_documents_array(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed a list of documents as one float32 matrix
+        """
+        logger.debug(f"Embedding {len(texts)} documents")
+        return self._encode(texts)
+    
+    def embed_query_array(self, text: str) -> np.ndarray:
+        """
+        Embed a single query as a float32 vector
+        """
         logger.debug("Embedding query")
-        embedding = self.model.encode([text], convert_to_tensor=False)
-        return embedding[0].tolist()
+        return self._encode([text])[0]
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode texts as unit-length float32 vectors, so inner product equals cosine similarity
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        
+        embeddings = np.stack(list(self.model.embed(texts, batch_size=self.batch_size))).astype(np.float32, copy=False)
+        return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
 
-def get_free_embeddings() -> FreeSentenceTransformerEmbeddings:
+@functools.cache
+def get_free_embeddings() -> Embeddings:
     """
-    Factory function to get free embeddings
+    Factory function to get free embeddings, backed by the persistent embedding cache.
+    The model is loaded once per process and shared by every vector store. It is only
+    shared copy-on-write across forked workers if it was loaded before the fork, which
+    main.py does at import when PRELOAD_EMBEDDINGS is set.
     """
-    return FreeSentenceTransformerEmbeddings()
\ No newline at end of file
+    if settings.EMBEDDING_BACKEND == "fastembed" and TextEmbedding is None:
+        logger.warning("EMBEDDING_BACKEND is fastembed but fastembed is not installed - using sentence-transformers")
+    
+    if settings.EMBEDDING_BACKEND == "fastembed" and TextEmbedding is not None:
+        embeddings = FastEmbedEmbeddings()
+    else:
+        embeddings = FreeSentenceTransformerEmbeddings()
+    return CachedEmbeddings(embeddings, settings.EMBEDDING_CACHE_PATH, namespace=embeddings.model_id)
\ No newline at end of file
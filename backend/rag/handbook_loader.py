@@ -2,15 +2,100 @@
 PDF Handbook Loader and Chunker
 Processes the 245-page IU admission handbook
 """
+import itertools
 import logging
-from typing import List, Dict, Any
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Any, Tuple
 from pathlib import Path
 import pypdf
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_text_splitters import TextSplitter
+
+# Optional: PDFium extracts text natively, several times faster than pypdf
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
 
 logger = logging.getLogger(__name__)
 
+# Smallest page range worth shipping to a worker process
+MIN_PAGES_PER_WORKER = 16
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    """
+    Extract text from pages [start, stop) - runs in a worker process, so it opens the PDF itself
+    """
+    with open(pdf_path, 'rb') as file:
+        pdf_reader = pypdf.PdfReader(file)
+        return [(page_num + 1, pdf_reader.pages[page_num].extract_text()) for page_num in range(start, stop)]
+
+def _extract_pages_pdfium(pdf_path: str) -> List[Tuple[int, str]]:
+    """
+    Extract text from all pages with PDFium
+    """
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        pages = []
+        for page_num in range(len(pdf)):
+            page = pdf[page_num]
+            textpage = page.get_textpage()
+            # PDFium uses CRLF line breaks and marks hyphenation points with U+FFFE
+            text = textpage.get_text_bounded().replace("\r\n", "\n").replace("\ufffe", "")
+            textpage.close()
+            page.close()
+            pages.append((page_num + 1, text))
+        return pages
+    finally:
+        pdf.close()
+
+class BoundaryTextSplitter(TextSplitter):
+    """
+    Greedy character splitter that cuts each chunk at the strongest boundary that fits
+    """
+    
+    # Strongest first, same preference as the paragraph / line / sentence / word cascade
+    BOUNDARIES = ("\n\n", "\n", ". ", " ")
+    _WHITESPACE = re.compile(r"\s")
+    
+    def split_text(self, text: str) -> List[str]:
+        """
+        Split text in one left-to-right pass instead of recursive split-and-merge
+        """
+        chunks = []
+        start = 0
+        length = len(text)
+        
+        while start < length:
+            end = min(start + self._chunk_size, length)
+            if end < length:
+                end = self._find_break(text, start, end)
+            
+            chunk = text[start:end].strip()
+            if chunk:
+                chunks.append(chunk)
+            if end >= length:
+                break
+            
+            # Step back by the overlap, then forward to the next word boundary
+            overlap_start = max(end - self._chunk_overlap, start + 1)
+            match = self._WHITESPACE.search(text, overlap_start, end)
+            start = match.end() if match else end
+        
+        return chunks
+    
+    def _find_break(self, text: str, start: int, end: int) -> int:
+        """
+        Position just after the last strongest boundary in text[start:end], or end if there is none
+        """
+        for boundary in self.BOUNDARIES:
+            position = text.rfind(boundary, start, end)
+            if position > start:
+                return position + len(boundary)
+        return end
+
 class HandbookLoader:
     """
     Loads and processes the IU admission handbook PDF
@@ -18,11 +103,9 @@ class HandbookLoader:
     
     def __init__(self, pdf_path: str = None):
         self.pdf_path = Path(pdf_path or "../data/Leitfaden.pdf")
-        self.text_splitter = RecursiveCharacterTextSplitter(
+        self.text_splitter = BoundaryTextSplitter(
             chunk_size=1500,
             chunk_overlap=200,
-            separators=["\n\n", "\n", ".", " ", ""],
-            length_function=len,
         )
         
     def load_pdf(self) -> List[Document]:
@@ -35,23 +118,24 @@ class HandbookLoader:
         documents = []
         
         try:
-            with open(self.pdf_path, 'rb') as file:
-                pdf_reader = pypdf.PdfReader(file)
-                
-                for page_num, page in enumerate(pdf_reader.pages, start=1):
-                    text = page.extract_text()
-                    
-                    if text.strip():
-                        # Create document with metadata
-                        doc = Document(
-                            page_content=text,
-                            metadata={
-                                "source": str(self.pdf_path),
-                                "page": page_num,
-                                "total_pages": len(pdf_reader.pages)
-                            }
-                        )
-                        documents.append(doc)
+            if pdfium is not None:
+                pages = _extract_pages_pdfium(str(self.pdf_path))
+                total_pages = len(pages)
+            else:
+                pages, total_pages = self._extract_pages_pypdf()
+            
+            for page_num, text in pages:
+                if text.strip():
+                    # Create document with metadata
+                    doc = Document(
+                        page_content=text,
+                        metadata={
+                            "source": str(self.pdf_path),
+                            "page": page_num,
+                            "total_pages": total_pages
+                        }
+                    )
+                    documents.append(doc)
                         
             logger.info(f"Loaded {len(documents)} pages from handbook")
             return documents
@@ -60,27 +144,46 @@ class HandbookLoader:
             logger.error(f"Error loading PDF: {str(e)}")
             raise
     
+    def _extract_pages_pypdf(self) -> Tuple[List[Tuple[int, str]], int]:
+        """
+        Extract text from all pages with pypdf when PDFium is not installed
+        """
+        with open(self.pdf_path, 'rb') as file:
+            total_pages = len(pypdf.PdfReader(file).pages)
+        
+        # pypdf is pure Python, so pages are parsed in parallel worker processes
+        # in contiguous ranges, each worker parsing the file once
+        workers = max(1, min(os.cpu_count() or 1, total_pages // MIN_PAGES_PER_WORKER))
+        
+        if workers == 1:
+            return _extract_page_range(str(self.pdf_path), 0, total_pages), total_pages
+        
+        step = -(-total_pages // workers)
+        ranges = [(start, min(start + step, total_pages)) for start in range(0, total_pages, step)]
+        pages = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_extract_page_range, str(self.pdf_path), start, stop)
+                for start, stop in ranges
+            ]
+            for future in as_completed(futures):
+                pages.extend(future.result())
+        pages.sort()
+        
+        return pages, total_pages
+    
     def chunk_documents(self, documents: List[Document]) -> List[Document]:
         """
         Split documents into smaller chunks for embedding
         """
-        chunks = []
+        chunks = self.text_splitter.split_documents(documents)
         
-        for doc in documents:
-            # Split the document text
-            split_docs = self.text_splitter.split_text(doc.page_content)
-            
-            # Create new documents with preserved metadata
-            for i, chunk_text in enumerate(split_docs):
-                chunk_doc = Document(
-                    page_content=chunk_text,
-                    metadata={
-                        **doc.metadata,
-                        "chunk_index": i,
-                        "chunk_total": len(split_docs)
-                    }
-                )
-                chunks.append(chunk_doc)
+        # Chunks of one page are contiguous - stamp their position within the page
+        for _, page_chunks in itertools.groupby(chunks, key=lambda chunk: chunk.metadata["page"]):
+            page_chunks = list(page_chunks)
+            for i, chunk in enumerate(page_chunks):
+                chunk.metadata["chunk_index"] = i
+                chunk.metadata["chunk_total"] = len(page_chunks)
         
         logger.info(f"Created {len(chunks)} chunks from {len(documents)} pages")
         return chunks
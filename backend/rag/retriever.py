@@ -2,32 +2,100 @@
 RAG Retriever for Admission Rules
 Queries the handbook for relevant admission criteria
 """
+import asyncio
+import functools
+import hashlib
+import io
 import logging
-import os
-from typing import List, Dict, Any, Optional
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Dict, Any, Optional
 import anthropic
 from langchain_core.documents import Document
+from config.settings import settings
+from clients import get_client, get_async_client, get_request_semaphore
 from .vector_store import HandbookVectorStore
 from .handbook_loader import HandbookLoader
+from .answer_cache import AnswerCache
 
 logger = logging.getLogger(__name__)
 
+# Claude responses kept per exact (model, prompt) - same chunks and question give the same answer at low temperature
+RESPONSE_CACHE_SIZE = 256
+
+# Prompt for answering a question from handbook chunks, split around the context and
+# question so a prompt is assembled by plain writes instead of template formatting
+ANSWER_PROMPT_HEAD = """You are an expert on IU admission rules and regulations. 
+        Use the following context from the IU admission handbook to answer the question.
+        Always cite the specific page numbers and sections when providing information.
+        If the information is not in the context, say so clearly.
+        
+        Context from handbook:
+        """
+ANSWER_PROMPT_QUESTION = """
+        
+        Question: """
+ANSWER_PROMPT_TAIL = """
+        
+        Answer (include page references):"""
+
+@dataclass(slots=True, frozen=True)
+class SourceRef:
+    """
+    Handbook chunk cited by an answer
+    """
+    page: Optional[int]
+    excerpt: str
+    chunk_index: Optional[int]
+
 class AdmissionRulesRetriever:
     """
     RAG system for retrieving and interpreting admission rules
     """
     
     def __init__(self):
-        self.vector_store = HandbookVectorStore()
-        
-        # Get API key from environment
-        anthropic_key = os.getenv("ANTHROPIC_API_KEY")
-        if not anthropic_key:
-            raise ValueError("ANTHROPIC_API_KEY not found in environment")
-            
-        self.client = anthropic.Anthropic(api_key=anthropic_key)
         self.model = "claude-3-5-sonnet-20241022"
         
+        # sha256(model + prompt) -> answer text, least recently used first
+        self._response_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._response_cache_lock = threading.Lock()
+    
+    @functools.cached_property
+    def vector_store(self) -> HandbookVectorStore:
+        """
+        Handbook vector store, built on first use - the embedding model is only loaded then
+        """
+        return HandbookVectorStore()
+    
+    @functools.cached_property
+    def answer_cache(self) -> AnswerCache:
+        """
+        Paraphrased questions are answered from the cache, skipping retrieval and Claude
+        """
+        return AnswerCache(self.vector_store.embeddings, model=self.model)
+    
+    @property
+    def is_initialized(self) -> bool:
+        """
+        Whether the handbook index is loaded, without building the vector store
+        """
+        return "vector_store" in self.__dict__ and self.vector_store.collection is not None
+    
+    @property
+    def client(self) -> anthropic.Anthropic:
+        """
+        Shared synchronous client, for callers outside the event loop
+        """
+        return get_client()
+    
+    @property
+    def async_client(self) -> anthropic.AsyncAnthropic:
+        """
+        Shared async client for the running event loop
+        """
+        return get_async_client()
+    
     def initialize(self, force_reload: bool = False):
         """
         Initialize the RAG system
@@ -46,68 +114,237 @@ class AdmissionRulesRetriever:
         """
         Query the handbook for specific admission rules
         """
-        if not hasattr(self.vector_store, 'vector_store') or not self.vector_store.vector_store:
+        if not self.is_initialized:
             raise ValueError("RAG system not initialized. Call initialize() first.")
         
         logger.info(f"Querying admission rules: {question[:100]}...")
         
+        cached = self.answer_cache.get(question)
+        if cached is not None:
+            return cached
+        
         # Get relevant documents
-        docs = self.vector_store.search(question, k=5)
+        docs = self.vector_store.search(question, k=settings.RETRIEVAL_K)
         
-        # Build context from documents
-        context = "\n\n".join([
-            f"Page {doc.metadata.get('page', '?')}: {doc.page_content}"
-            for doc in docs
-        ])
+        result = {
+            "answer": self._answer_from_documents(question, docs),
+            "sources": self._build_sources(docs),
+            "question": question
+        }
+        self.answer_cache.put(question, result)
+        return result
+    
+    async def aquery_admission_rules(self, question: str) -> Dict[str, Any]:
+        """
+        Async variant of query_admission_rules - local retrieval runs in a worker thread, Claude is awaited
+        """
+        if not self.is_initialized:
+            raise ValueError("RAG system not initialized. Call initialize() first.")
         
-        # Create prompt
-        prompt = f"""You are an expert on IU admission rules and regulations. 
-        Use the following context from the IU admission handbook to answer the question.
-        Always cite the specific page numbers and sections when providing information.
-        If the information is not in the context, say so clearly.
+        logger.info(f"Querying admission rules: {question[:100]}...")
         
-        Context from handbook:
-        {context}
+        cached = await asyncio.to_thread(self.answer_cache.get, question)
+        if cached is not None:
+            return cached
         
-        Question: {question}
+        docs = await asyncio.to_thread(self.vector_store.search, question, settings.RETRIEVAL_K)
         
-        Answer (include page references):"""
+        result = {
+            "answer": await self._aanswer_from_documents(question, docs),
+            "sources": self._build_sources(docs),
+            "question": question
+        }
+        await asyncio.to_thread(self.answer_cache.put, question, result)
+        return result
+    
+    async def astream_admission_rules(self, question: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream an answer: the sources and question first, as soon as retrieval is done,
+        then the answer text as {"answer_delta": ...} events while Claude generates it
+        """
+        if not self.is_initialized:
+            raise ValueError("RAG system not initialized. Call initialize() first.")
         
-        # Query Anthropic
-        try:
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=1000,
-                temperature=0.1,
-                messages=[{"role": "user", "content": prompt}]
-            )
+        logger.info(f"Streaming admission rules: {question[:100]}...")
+        
+        cached = await asyncio.to_thread(self.answer_cache.get, question)
+        if cached is not None:
+            yield {"sources": cached["sources"], "question": question}
+            yield {"answer_delta": cached["answer"]}
+            return
+        
+        docs = await asyncio.to_thread(self.vector_store.search, question, settings.RETRIEVAL_K)
+        sources = self._build_sources(docs)
+        yield {"sources": sources, "question": question}
+        
+        request = self._build_answer_request(question, docs)
+        key = self._response_key(request)
+        answer = self._get_cached_response(key)
+        if answer is not None:
+            yield {"answer_delta": answer}
+        else:
+            parts = []
+            try:
+                async with get_request_semaphore():
+                    async with self.async_client.messages.stream(**request) as stream:
+                        async for text in stream.text_stream:
+                            parts.append(text)
+                            yield {"answer_delta": text}
+            except Exception as e:
+                logger.error(f"Query failed: {str(e)}")
+                raise
             
+            # Only complete answers are cached
+            answer = "".join(parts)
+            self._cache_response(key, answer)
+        
+        await asyncio.to_thread(
+            self.answer_cache.put, question, {"answer": answer, "sources": sources, "question": question}
+        )
+    
+    def query_admission_rules_batch(self, questions: List[str], k: int = 5) -> Dict[str, Any]:
+        """
+        Answer several admission questions from a single batched retrieval
+        """
+        if not self.is_initialized:
+            raise ValueError("RAG system not initialized. Call initialize() first.")
+        
+        logger.info(f"Querying admission rules for {len(questions)} questions")
+        
+        # One embedding batch + one index lookup, chunks deduplicated across questions
+        docs = self.vector_store.search_batch(questions, k=k)
+        
+        return {
+            "answer": self._answer_from_documents(self._number_questions(questions), docs),
+            "sources": self._build_sources(docs),
+            "questions": questions
+        }
+    
+    async def aquery_admission_rules_batch(self, questions: List[str], k: int = 5) -> Dict[str, Any]:
+        """
+        Async variant of query_admission_rules_batch
+        """
+        if not self.is_initialized:
+            raise ValueError("RAG system not initialized. Call initialize() first.")
+        
+        logger.info(f"Querying admission rules for {len(questions)} questions")
+        
+        docs = await asyncio.to_thread(self.vector_store.search_batch, questions, k)
+        
+        return {
+            "answer": await self._aanswer_from_documents(self._number_questions(questions), docs),
+            "sources": self._build_sources(docs),
+            "questions": questions
+        }
+    
+    def _number_questions(self, questions: List[str]) -> str:
+        return "\n".join(f"{i}. {question}" for i, question in enumerate(questions, start=1))
+    
+    def _answer_from_documents(self, question: str, docs: List[Document]) -> str:
+        """
+        Ask Claude to answer the question using the retrieved handbook chunks
+        """
+        request = self._build_answer_request(question, docs)
+        key = self._response_key(request)
+        cached = self._get_cached_response(key)
+        if cached is not None:
+            return cached
+        
+        try:
+            response = self.client.messages.create(**request)
             answer = response.content[0].text
+            self._cache_response(key, answer)
+            return answer
             
-            # Extract source information
-            sources = []
-            for doc in docs:
-                sources.append({
-                    "page": doc.metadata.get("page"),
-                    "excerpt": doc.page_content[:200] + "...",
-                    "chunk_index": doc.metadata.get("chunk_index")
-                })
-            
-            return {
-                "answer": answer,
-                "sources": sources,
-                "question": question
-            }
+        except Exception as e:
+            logger.error(f"Query failed: {str(e)}")
+            raise
+    
+    async def _aanswer_from_documents(self, question: str, docs: List[Document]) -> str:
+        """
+        Async variant of _answer_from_documents
+        """
+        request = self._build_answer_request(question, docs)
+        key = self._response_key(request)
+        cached = self._get_cached_response(key)
+        if cached is not None:
+            return cached
+        
+        try:
+            async with get_request_semaphore():
+                response = await self.async_client.messages.create(**request)
+            answer = response.content[0].text
+            self._cache_response(key, answer)
+            return answer
             
         except Exception as e:
             logger.error(f"Query failed: {str(e)}")
             raise
     
+    def _build_answer_request(self, question: str, docs: List[Document]) -> Dict[str, Any]:
+        """
+        Build the Messages API parameters for answering a question from handbook chunks
+        """
+        # The whole prompt is written into one buffer - no per-chunk strings, no separate context copy
+        prompt = io.StringIO()
+        prompt.write(ANSWER_PROMPT_HEAD)
+        for i, doc in enumerate(docs):
+            if i:
+                prompt.write("\n\n")
+            prompt.write("Page ")
+            prompt.write(str(doc.metadata.get("page", "?")))
+            prompt.write(": ")
+            prompt.write(doc.page_content)
+        prompt.write(ANSWER_PROMPT_QUESTION)
+        prompt.write(question)
+        prompt.write(ANSWER_PROMPT_TAIL)
+        
+        return {
+            "model": self.model,
+            "max_tokens": 1000,
+            "temperature": 0.1,
+            "messages": [{"role": "user", "content": prompt.getvalue()}]
+        }
+    
+    def _response_key(self, request: Dict[str, Any]) -> str:
+        prompt = request["messages"][0]["content"]
+        return hashlib.sha256(f"{request['model']}\0{prompt}".encode("utf-8")).hexdigest()
+    
+    def _get_cached_response(self, key: str) -> Optional[str]:
+        with self._response_cache_lock:
+            answer = self._response_cache.get(key)
+            if answer is not None:
+                self._response_cache.move_to_end(key)
+                logger.info("Response cache hit")
+            return answer
+    
+    def _cache_response(self, key: str, answer: str):
+        with self._response_cache_lock:
+            self._response_cache[key] = answer
+            self._response_cache.move_to_end(key)
+            if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+    
+    def _build_sources(self, docs: List[Document]) -> List[SourceRef]:
+        """
+        Extract source information for the retrieved chunks
+        """
+        sources = []
+        for doc in docs:
+            sources.append(SourceRef(
+                page=doc.metadata.get("page"),
+                excerpt=doc.page_content[:200] + "...",
+                chunk_index=doc.metadata.get("chunk_index")
+            ))
+        
+        return sources
+    
     def check_admission_criteria(self, applicant_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Check if an applicant meets admission criteria based on handbook rules
         """
-        # Build a comprehensive query based on applicant data
+        # One question per criterion - each gets its own retrieval instead of
+        # sharing a single search for the combined question
         query_parts = []
         
         if applicant_data.get("target_program"):
@@ -122,18 +359,15 @@ class AdmissionRulesRetriever:
         if applicant_data.get("work_experience_years"):
             query_parts.append(f"work experience requirements ({applicant_data['work_experience_years']} years)")
         
-        query = "What are the " + " and ".join(query_parts) + "?"
+        if not query_parts:
+            query_parts.append("general admission requirements")
         
-        return self.query_admission_rules(query)
+        # One embedding batch and one index lookup; chunks shared between criteria are merged
+        return self.query_admission_rules_batch([f"What are the {part}?" for part in query_parts])
     
     def find_relevant_sections(self, topics: List[str], k: int = 3) -> Dict[str, List[Document]]:
         """
         Find relevant handbook sections for multiple topics
         """
-        results = {}
-        
-        for topic in topics:
-            docs = self.vector_store.search(topic, k=k)
-            results[topic] = docs
-            
-        return results
\ No newline at end of file
+        # All topics embedded in one batch and scored in one index lookup
+        return dict(zip(topics, self.vector_store.search_many(topics, k=k)))
\ No newline at end of file
@@ -2,52 +2,80 @@
 Vector Store for RAG System
 Handles embedding and retrieval of handbook chunks using FREE embeddings
 """
+import hashlib
+import json
 import logging
-from typing import List, Dict, Any, Optional
-from langchain_community.vectorstores import Chroma
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Union
+import chromadb
+import numpy as np
+from chromadb.api.models.Collection import Collection
 from langchain_core.documents import Document
+from config.settings import settings
 from .free_embeddings import get_free_embeddings
 
 logger = logging.getLogger(__name__)
 
+# Query embeddings kept in memory - repeated questions skip the embedding model entirely
+QUERY_CACHE_SIZE = 512
+
+# Collection name used by earlier LangChain-built indexes, so existing ones keep loading
+COLLECTION_NAME = "langchain"
+
+# Relevance vs. diversity trade-off for MMR search
+MMR_LAMBDA = 0.5
+
+# Chunks per Chroma add call - stays under Chroma's maximum batch size
+ADD_BATCH_SIZE = 4096
+
+# Snapshot of the search matrix and its chunks, stored next to the Chroma files
+MATRIX_FILENAME = "handbook_embeddings.npy"
+CHUNKS_FILENAME = "handbook_chunks.json"
+
 class HandbookVectorStore:
     """
-    Vector store for handbook chunks using ChromaDB
+    Vector store for handbook chunks. ChromaDB persists the chunks; unfiltered
+    searches run as exact inner-product search over an in-memory matrix.
     """
     
     def __init__(self, persist_directory: str = "./chroma_db"):
         self.persist_directory = persist_directory
         self.embeddings = get_free_embeddings()  # FREE local embeddings!
-        self.vector_store = None
+        # Native ChromaDB collection - vectors are always computed here, never by Chroma
+        self.collection: Optional[Collection] = None
+        
+        # Every chunk embedding as one contiguous float32 matrix of unit rows, parallel to _docs.
+        # The handbook has a few thousand chunks at most, so exact search is one BLAS GEMV.
+        self._matrix: Optional[np.ndarray] = None
+        self._docs: List[Document] = []
+        # Per-row scales when the matrix is int8-quantized, otherwise None
+        self._scales: Optional[np.ndarray] = None
         
-    def create_or_load_index(self, documents: Optional[List[Document]] = None) -> Chroma:
+        # sha256(query) -> embedding, in LRU order. Searches run in worker threads, so access is locked.
+        self._query_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        
+    def create_or_load_index(self, documents: Optional[List[Document]] = None) -> Collection:
         """
         Create a new index or load existing one
         """
-        import os
-        
         if documents:
             # Create new index
             logger.info("Creating new vector store index...")
-            self.vector_store = Chroma.from_documents(
-                documents=documents,
-                embedding=self.embeddings,
-                persist_directory=self.persist_directory
-            )
-            self.vector_store.persist()
-            logger.info(f"Index created with {len(documents)} documents")
+            self._index_documents(documents)
         else:
             # Check if existing index exists and has data
             if os.path.exists(self.persist_directory):
                 logger.info("Loading existing vector store...")
                 try:
-                    self.vector_store = Chroma(
-                        persist_directory=self.persist_directory,
-                        embedding_function=self.embeddings
-                    )
-                    # Test if it has any data
-                    test_result = self.vector_store.similarity_search("test", k=1)
-                    logger.info(f"Loaded existing vector store with data")
+                    self.collection = self._open_collection()
+                    # Native count - a SQLite query, no embedding model call
+                    count = self.collection.count()
+                    if count == 0:
+                        raise ValueError("vector store is empty")
+                    logger.info(f"Loaded existing vector store with {count} chunks")
                 except Exception as e:
                     logger.warning(f"Failed to load existing vector store: {e}")
                     logger.info("Creating new vector store from handbook...")
@@ -55,61 +83,362 @@ class HandbookVectorStore:
                     from .handbook_loader import HandbookLoader
                     loader = HandbookLoader()
                     chunks = loader.process_handbook()
-                    self.vector_store = Chroma.from_documents(
-                        documents=chunks,
-                        embedding=self.embeddings,
-                        persist_directory=self.persist_directory
-                    )
-                    self.vector_store.persist()
-                    logger.info(f"New index created with {len(chunks)} documents")
+                    self._index_documents(chunks)
             else:
                 logger.info("No existing vector store found. Creating new one from handbook...")
                 # Load and process handbook
                 from .handbook_loader import HandbookLoader
                 loader = HandbookLoader()
                 chunks = loader.process_handbook()
-                self.vector_store = Chroma.from_documents(
-                    documents=chunks,
-                    embedding=self.embeddings,
-                    persist_directory=self.persist_directory
+                self._index_documents(chunks)
+        
+        # A loaded index reuses the search matrix snapshot if it matches the collection
+        if self._matrix is None and not self._load_matrix_snapshot():
+            self._load_matrix()
+            self._save_matrix_snapshot()
+        
+        if settings.HANDBOOK_INDEX_INT8 and self._matrix is not None and self._scales is None:
+            self._quantize_matrix()
+        
+        self._warm_up()
+        return self.collection
+    
+    def _warm_up(self):
+        """
+        Run one throwaway query so the first user query does not pay for the model's first
+        forward pass, Chroma loading its HNSW index, or faulting in the search matrix
+        """
+        try:
+            # Bypass the embedding cache - a cached "warmup" vector would never reach the model
+            model = getattr(self.embeddings, "embeddings", self.embeddings)
+            vector = model.embed_query_array("warmup")
+            self.collection.query(query_embeddings=[vector.tolist()], n_results=1, include=["distances"])
+            if self._matrix is not None:
+                self._top_k(vector, 1)
+            logger.info("Vector store warmed up")
+        except Exception as e:
+            logger.warning(f"Vector store warm-up failed: {e}")
+    
+    def _index_documents(self, documents: List[Document]):
+        """
+        Bring the Chroma collection in line with the given chunks. Chunks are identified by a
+        hash of their page and content, so re-indexing an unchanged handbook embeds nothing,
+        and only new or edited chunks are embedded and added.
+        """
+        self.collection = self._open_collection()
+        
+        # Identical chunks collapse onto one id
+        chunks = {self._chunk_id(doc): doc for doc in documents}
+        existing_ids = set(self.collection.get(include=[])["ids"])
+        
+        stale_ids = list(existing_ids - chunks.keys())
+        if stale_ids:
+            self.collection.delete(ids=stale_ids)
+        
+        new_ids = [chunk_id for chunk_id in chunks if chunk_id not in existing_ids]
+        if new_ids:
+            # All new chunks are embedded in one batched call, then handed to Chroma precomputed
+            texts = [chunks[chunk_id].page_content for chunk_id in new_ids]
+            vectors = self.embeddings.embed_documents_array(texts)
+            for start in range(0, len(new_ids), ADD_BATCH_SIZE):
+                stop = start + ADD_BATCH_SIZE
+                self.collection.add(
+                    ids=new_ids[start:stop],
+                    embeddings=vectors[start:stop].tolist(),
+                    documents=texts[start:stop],
+                    metadatas=[chunks[chunk_id].metadata for chunk_id in new_ids[start:stop]]
+                )
+        
+        # The persistent client writes through - there is no separate persist step
+        logger.info(
+            f"Index updated: {len(new_ids)} chunks added, {len(stale_ids)} removed, "
+            f"{len(chunks) - len(new_ids)} unchanged"
+        )
+        
+        # The collection changed, so the search matrix and its snapshot are rebuilt
+        self._load_matrix()
+        self._save_matrix_snapshot()
+    
+    def _open_collection(self) -> Collection:
+        """
+        Open the handbook collection in the persistent Chroma database, creating it if needed
+        """
+        client = chromadb.PersistentClient(path=self.persist_directory)
+        return client.get_or_create_collection(COLLECTION_NAME, embedding_function=None)
+    
+    def _chunk_id(self, doc: Document) -> str:
+        content = f"{doc.metadata.get('page', '')}\0{doc.page_content}"
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+    
+    def _load_matrix_snapshot(self) -> bool:
+        """
+        Load the search matrix from its .npy snapshot, skipping the decode from Chroma.
+        Returns False if there is no snapshot or it does not match the collection.
+        """
+        matrix_path = os.path.join(self.persist_directory, MATRIX_FILENAME)
+        chunks_path = os.path.join(self.persist_directory, CHUNKS_FILENAME)
+        if not (os.path.exists(matrix_path) and os.path.exists(chunks_path)):
+            return False
+        
+        try:
+            # Memory-mapped: pages are read on demand, and workers on one host share them in the page cache
+            matrix = np.load(matrix_path, mmap_mode="r")
+            with open(chunks_path, encoding="utf-8") as f:
+                chunks = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to load search matrix snapshot: {e}")
+            return False
+        
+        if len(matrix) != len(chunks) or len(chunks) != self.collection.count():
+            logger.info("Search matrix snapshot is stale, reloading from Chroma")
+            return False
+        
+        self._matrix = matrix
+        self._scales = None
+        self._docs = [Document(page_content=chunk["text"], metadata=chunk["metadata"]) for chunk in chunks]
+        logger.info(f"Loaded {len(self._docs)} chunk embeddings from snapshot")
+        return True
+    
+    def _save_matrix_snapshot(self):
+        """
+        Write the search matrix and its chunks next to the Chroma files
+        """
+        if self._matrix is None:
+            return
+        
+        matrix_path = os.path.join(self.persist_directory, MATRIX_FILENAME)
+        chunks_path = os.path.join(self.persist_directory, CHUNKS_FILENAME)
+        
+        # Written to temporary files and renamed into place: a snapshot still memory-mapped by
+        # this or another process must never be truncated underneath it
+        try:
+            os.makedirs(self.persist_directory, exist_ok=True)
+            with open(f"{matrix_path}.tmp", "wb") as f:
+                np.save(f, self._matrix)
+            with open(f"{chunks_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump(
+                    [{"text": doc.page_content, "metadata": doc.metadata} for doc in self._docs],
+                    f, ensure_ascii=False
                 )
-                self.vector_store.persist()
-                logger.info(f"New index created with {len(chunks)} documents")
-            
-        return self.vector_store
+            os.replace(f"{matrix_path}.tmp", matrix_path)
+            os.replace(f"{chunks_path}.tmp", chunks_path)
+        except OSError as e:
+            logger.warning(f"Failed to save search matrix snapshot: {e}")
+    
+    def _load_matrix(self):
+        """
+        Load every chunk and its embedding from Chroma into memory
+        """
+        data = self.collection.get(include=["embeddings", "documents", "metadatas"])
+        
+        self._scales = None
+        if not data["ids"]:
+            self._matrix = None
+            self._docs = []
+            return
+        
+        matrix = np.asarray(data["embeddings"], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.maximum(norms, 1e-12)
+        
+        self._matrix = matrix
+        self._docs = [
+            Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(data["documents"], data["metadatas"])
+        ]
+        logger.info(f"Loaded {len(self._docs)} chunk embeddings for exact search")
     
-    def search(self, query: str, k: int = 5, filter_dict: Optional[Dict] = None) -> List[Document]:
+    def search(
+        self,
+        query: str,
+        k: int = 5,
+        filter_dict: Optional[Dict] = None,
+        return_scores: bool = False,
+        mmr: bool = False
+    ) -> Union[List[Document], List[Tuple[Document, float]]]:
         """
-        Search for relevant chunks
+        Search for relevant chunks, optionally with distance scores - lower is more similar.
+        The query is embedded once for either form. With mmr, the k chunks are picked from
+        the 4k nearest for diversity (maximal marginal relevance).
         """
-        if not self.vector_store:
+        if self.collection is None:
             raise ValueError("Vector store not initialized. Call create_or_load_index first.")
+        if mmr and return_scores:
+            raise ValueError("MMR search does not return scores")
         
-        if filter_dict:
-            results = self.vector_store.similarity_search(
-                query=query,
-                k=k,
-                filter=filter_dict
-            )
+        query_vector = self._embed_query(query)
+        
+        if mmr:
+            results = self._query_mmr(query_vector, k, filter_dict)
+        elif filter_dict or self._matrix is None:
+            # Metadata filters are evaluated by Chroma
+            results = self._query_collection(query_vector, k, filter_dict)
+            if not return_scores:
+                results = [doc for doc, _ in results]
+        elif return_scores:
+            # Cosine distance
+            results = [(self._docs[i], 1.0 - score) for i, score in self._top_k(query_vector, k)]
         else:
-            results = self.vector_store.similarity_search(
-                query=query,
-                k=k
-            )
+            results = [self._docs[i] for i, _ in self._top_k(query_vector, k)]
         
         logger.debug(f"Found {len(results)} relevant chunks for query: {query[:100]}...")
         return results
     
-    def search_with_scores(self, query: str, k: int = 5) -> List[tuple]:
+    def search_batch(self, queries: List[str], k: int = 5) -> List[Document]:
+        """
+        Search for several queries with one embedding batch and one index lookup.
+        Chunks matched by more than one query are returned once.
+        """
+        if self.collection is None:
+            raise ValueError("Vector store not initialized. Call create_or_load_index first.")
+        
+        if self._matrix is None:
+            return []
+        
+        # Chunks matched by several queries are kept once, at their first position
+        top = self._top_k_many(queries, k)
+        docs = [self._docs[i] for i in dict.fromkeys(top.ravel().tolist())]
+        
+        logger.debug(f"Found {len(docs)} unique chunks for {len(queries)} queries")
+        return docs
+    
+    def search_many(self, queries: List[str], k: int = 5) -> List[List[Document]]:
         """
-        Search with relevance scores
+        Search for several queries with one embedding batch and one index lookup,
+        returning the top-k chunks of each query separately
         """
-        if not self.vector_store:
+        if self.collection is None:
             raise ValueError("Vector store not initialized. Call create_or_load_index first.")
         
-        results = self.vector_store.similarity_search_with_score(
-            query=query,
-            k=k
+        if self._matrix is None:
+            return [[] for _ in queries]
+        
+        return [[self._docs[i] for i in row] for row in self._top_k_many(queries, k).tolist()]
+    
+    def _query_collection(self, query_vector: np.ndarray, k: int, filter_dict: Optional[Dict]) -> List[Tuple[Document, float]]:
+        """
+        Nearest chunks from Chroma with their cosine distances, best first
+        """
+        result = self.collection.query(
+            query_embeddings=[query_vector.tolist()],
+            n_results=k,
+            where=filter_dict or None,
+            include=["documents", "metadatas", "distances"]
         )
+        # The collection uses Chroma's default squared-L2 space; for unit vectors that is
+        # 2 - 2cos, so halving it gives the cosine distance the matrix path returns
+        return [
+            (Document(page_content=text, metadata=metadata or {}), distance / 2)
+            for text, metadata, distance in zip(
+                result["documents"][0], result["metadatas"][0], result["distances"][0]
+            )
+        ]
+    
+    def _query_mmr(self, query_vector: np.ndarray, k: int, filter_dict: Optional[Dict]) -> List[Document]:
+        """
+        Pick k of the 4k nearest chunks by maximal marginal relevance: each pick trades
+        similarity to the query against similarity to the chunks already picked
+        """
+        result = self.collection.query(
+            query_embeddings=[query_vector.tolist()],
+            n_results=4 * k,
+            where=filter_dict or None,
+            include=["documents", "metadatas", "embeddings"]
+        )
+        texts, metadatas = result["documents"][0], result["metadatas"][0]
+        if not texts:
+            return []
+        
+        candidates = np.asarray(result["embeddings"][0], dtype=np.float32)
+        candidates /= np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+        relevance = candidates @ (query_vector / np.maximum(np.linalg.norm(query_vector), 1e-12))
+        
+        selected = [int(np.argmax(relevance))]
+        while len(selected) < min(k, len(texts)):
+            redundancy = (candidates @ candidates[selected].T).max(axis=1)
+            mmr_scores = MMR_LAMBDA * relevance - (1 - MMR_LAMBDA) * redundancy
+            mmr_scores[selected] = -np.inf
+            selected.append(int(np.argmax(mmr_scores)))
+        
+        return [Document(page_content=texts[i], metadata=metadatas[i] or {}) for i in selected]
+    
+    def _top_k_many(self, queries: List[str], k: int) -> np.ndarray:
+        """
+        Exact top-k chunk indices for each query, best first, shape (queries, k)
+        """
+        k = min(k, self._matrix.shape[0])
+        if not queries or k <= 0:
+            return np.empty((len(queries), 0), dtype=np.intp)
+        
+        # All queries scored in one GEMM, then a partial top-k per query
+        query_matrix = self.embeddings.embed_queries_array(queries)
+        query_matrix = query_matrix / np.maximum(np.linalg.norm(query_matrix, axis=1, keepdims=True), 1e-12)
+        scores = self._scores(query_matrix)
+        
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        return np.take_along_axis(top, np.argsort(-top_scores, axis=1), axis=1)
+    
+    def search_with_scores(self, query: str, k: int = 5, filter_dict: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        """
+        Search with distance scores - lower is more similar
+        """
+        return self.search(query, k=k, filter_dict=filter_dict, return_scores=True)
+    
+    def _quantize_matrix(self):
+        """
+        Store the search matrix as int8 with one scale per row - a quarter of the memory
+        """
+        scales = np.maximum(np.abs(self._matrix).max(axis=1), 1e-12) / 127
+        self._matrix = np.round(self._matrix / scales[:, np.newaxis]).astype(np.int8)
+        self._scales = scales.astype(np.float32)
+        logger.info(f"Quantized search matrix to int8 ({self._matrix.nbytes // 1024} KiB)")
+    
+    def _scores(self, query_matrix: np.ndarray) -> np.ndarray:
+        """
+        Cosine similarity of unit-length query rows against every chunk, shape (queries, chunks)
+        """
+        if self._scales is None:
+            return query_matrix @ self._matrix.T
+        
+        # Queries are quantized too and dot products accumulate in int32,
+        # so the int8 matrix is never widened into a float copy
+        query_scales = np.maximum(np.abs(query_matrix).max(axis=1), 1e-12) / 127
+        quantized = np.round(query_matrix / query_scales[:, np.newaxis]).astype(np.int8)
+        dots = np.einsum("qd,nd->qn", quantized, self._matrix, dtype=np.int32)
+        return dots * query_scales[:, np.newaxis] * self._scales[np.newaxis, :]
+    
+    def _top_k(self, query_vector: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        """
+        Exact top-k chunks by cosine similarity, best first
+        """
+        query_vector = query_vector / np.maximum(np.linalg.norm(query_vector), 1e-12)
+        scores = self._scores(query_vector[np.newaxis, :])[0]
+        
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        # Partial selection is O(n); only the k winners are sorted
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+    
+    def _embed_query(self, query: str) -> np.ndarray:
+        """
+        Embed a query, memoized with LRU eviction
+        """
+        key = hashlib.sha256(query.encode("utf-8")).hexdigest()
+        
+        with self._query_cache_lock:
+            vector = self._query_cache.get(key)
+            if vector is not None:
+                self._query_cache.move_to_end(key)
+                return vector
+        
+        vector = self.embeddings.embed_query_array(query)
         
-        return results
\ No newline at end of file
+        with self._query_cache_lock:
+            self._query_cache[key] = vector
+            if len(self._query_cache) > QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return vector
\ No newline at end of file